@@ -1,32 +1,37 @@
 """# auth_protocol.py"""
+import hashlib
 import json
 import logging
-from typing import Optional, Dict, Any
+from typing import TYPE_CHECKING, Optional, Dict, Any, Tuple
 import secrets
-import requests
-from Crypto.Hash import SHA256, SHA1
+import struct
+import threading
+import time
+from functools import lru_cache
+import asyncio
 from Crypto.Random import get_random_bytes
 from Crypto.Cipher import AES
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+if TYPE_CHECKING:
+    import aiohttp
+
 log = logging.getLogger(__name__)
 
 
 def sha1(data: bytes) -> bytes:
     """Calculate SHA1 hash of the given data"""
-    return SHA1.new(data).digest()
+    return hashlib.sha1(data).digest()
 
 
 def sha256(data: bytes) -> bytes:
     """Calculate SHA256 hash of the given data"""
-    return SHA256.new(data).digest()
+    return hashlib.sha256(data).digest()
 
 
 def pkcs7_pad(data: bytes, block_size: int = 16) -> bytes:
     """Apply PKCS#7 padding to the given data"""
     pad_len = block_size - (len(data) % block_size)
-    return data + bytes([pad_len] * pad_len)
+    return data + bytes((pad_len,)) * pad_len
 
 
 def pkcs7_unpad(data: bytes) -> bytes:
@@ -37,121 +42,569 @@ def pkcs7_unpad(data: bytes) -> bytes:
     return data[:-pad_len]
 
 
+def pkcs7_blank(data: bytearray) -> bytearray:
+    """
+    Validate PKCS#7 padding and overwrite it with spaces in place, so the buffer can be
+    handed to json.loads as-is (trailing whitespace) instead of being sliced into a copy
+    """
+    pad_len = data[-1]
+    if pad_len < 1 or pad_len > 16 or data[-pad_len:].count(pad_len) != pad_len:
+        raise ValueError("Invalid PKCS#7 padding")
+    data[-pad_len:] = b" " * pad_len
+    return data
+
+
+# Session lifetime when the device does not send a TIMEOUT cookie with handshake1
+DEFAULT_SESSION_TIMEOUT = 86400
+# Re-key this long before the device drops the session (at most 20% of its lifetime)
+SESSION_REFRESH_MARGIN = 20 * 60
+# Wait this long before retrying a failed re-key; the current session is kept meanwhile
+SESSION_REFRESH_RETRY = 60
+
+# Device error codes that mean the session (not the request) is no longer valid
+SESSION_ERROR_CODES = {
+    9999,   # session timeout
+    -1501,  # login error
+    -1005,  # AES decode failure
+    1002,   # transport not available
+    1003,   # unknown credentials
+}
+
+# HTTP statuses the device answers with when it no longer knows the session cookie
+SESSION_HTTP_STATUSES = {401, 403}
+
+# Consecutive responses failing verification after which the session keys are presumed wrong
+SIGNATURE_FAILURE_LIMIT = 3
+
+
+@lru_cache(maxsize=256)
+def calc_auth_hash(username: str, password: str) -> bytes:
+    """Authentication hash of a credential pair; cached, as devices often share credentials"""
+    return sha256(sha1(username.encode()) + sha1(password.encode()))
+
+
+# Credentials tried after the configured ones: unbound devices and factory setup
+FALLBACK_CREDENTIALS = [
+    ("", ""),
+    ("kasa@tp-link.net", "kasaSetup"),
+]
+
+# Wire format of the request sequence number
+_SEQ = struct.Struct(">i")
+
+
 class AuthProtocolError(Exception):
     """Custom error for AuthProtocol failures"""
 
-class AuthProtocol:
-    """TP-Link Auth Protocol for communication with devices"""
+    def __init__(self, message: str, error_code: Optional[int] = None):
+        super().__init__(message)
+        self.error_code = error_code
 
-    def __init__(self, address: str, username: str, password: str):
-        """Initialize the AuthProtocol with device address, username, and password"""
-        self.session    = requests.Session()  # single session, stores cookie
+
+class AuthProtocolSessionError(AuthProtocolError):
+    """The device session is invalid or expired; the next request performs a new handshake"""
+
+
+class AuthProtocolSignatureError(AuthProtocolError):
+    """
+    A response is malformed or not signed for the request's seq; the session is kept
+    until SIGNATURE_FAILURE_LIMIT responses in a row fail
+    """
+
+
+class ProtocolObserver:
+    """Hooks to instrument protocol traffic; this default implementation does nothing"""
+
+    def round_trip(self, address: str, method: str, seconds: float, sent: int, received: int) -> None:
+        """
+        An HTTP round-trip completed: handshake1, handshake2 or a request method; a
+        multipleRequest by its sorted methods joined with '+'
+        """
+
+    def stage(self, address: str, stage: str, seconds: float) -> None:
+        """Local work on a request: 'encode' (JSON + encrypt + sign) or 'decode' (verify + decrypt + JSON)"""
+
+    def handshake(self, address: str, seconds: float, ok: bool) -> None:
+        """A full handshake finished, successfully or not"""
+
+    def poll(self, address: str, ok: bool) -> None:
+        """A device poll finished, successfully or not (also when cut off at its deadline)"""
+
+
+    def device_error(self, address: str, error_code: str) -> None:
+        """
+        The device answered with an error code, a response failed verification ('signature',
+        'decode') or the HTTP request failed ('transport': connection errors, timeouts, HTTP errors)
+        """
+
+
+class SessionState:
+    """
+    Keys and cookie of one handshake, derived once and reused by every request of the session.
+    The cookie travels with the keys, so a re-key can run next to requests of the current session.
+    """
+
+    __slots__ = ("key", "iv", "sig", "seq", "cookie", "refresh_at", "expires_at")
+
+    def __init__(
+            self,
+            local_seed: bytes,
+            remote_seed: bytes,
+            auth_hash: bytes,
+            lifetime: int,
+            cookie: Optional[str] = None
+        ):
+        """Derive the session key, iv, seq and signature prefix after a handshake"""
+        seeds = local_seed + remote_seed + auth_hash
+        self.key = sha256(b"lsk" + seeds)[:16]
+        ivseq = sha256(b"iv" + seeds)
+        self.iv = ivseq[:12]
+        self.seq: int = _SEQ.unpack(ivseq[-4:])[0]
+        self.sig = sha256(b"ldk" + seeds)[:28]
+        self.cookie = cookie  # Cookie header of the session, as set by handshake1
+        now = time.monotonic()
+        self.expires_at = now + lifetime
+        self.refresh_at = now + lifetime - min(SESSION_REFRESH_MARGIN, lifetime * 0.2)
+
+
+    def encrypt(self, data: bytes) -> Tuple[int, bytes]:
+        """Encrypt and sign data with the next sequence number; returns (seq, signature + ciphertext)"""
+        seq = self.seq + 1
+        if seq > 0x7FFFFFFF:
+            # seq is a signed 32-bit counter on the wire
+            seq = -0x80000000
+        self.seq = seq
+        seq_bytes = _SEQ.pack(seq)
+        ciphertext = AES.new(self.key, AES.MODE_CBC, iv=self.iv + seq_bytes).encrypt(pkcs7_pad(data))
+        return seq, self._signature(seq_bytes, ciphertext) + ciphertext
+
+
+    def _signature(self, seq_bytes: bytes, ciphertext) -> bytes:
+        """SHA256 over signature prefix, seq and ciphertext, without concatenating them"""
+        digest = hashlib.sha256(self.sig)
+        digest.update(seq_bytes)
+        digest.update(ciphertext)
+        return digest.digest()
+
+
+    def decrypt(self, seq: int, data: bytes, verify: bool = True) -> bytearray:
+        """
+        Verify and decrypt the response to the request sent with seq. The body is read
+        through a memoryview and decrypted into one buffer whose padding is blanked,
+        ready for json.loads
+        """
+        view = memoryview(data)
+        # 32-byte signature followed by whole AES blocks
+        if len(view) < 48 or (len(view) - 32) % 16:
+            raise AuthProtocolSignatureError(f"Malformed response of {len(view)} bytes")
+        seq_bytes = _SEQ.pack(seq)
+        ciphertext = view[32:]
+        if verify and not secrets.compare_digest(self._signature(seq_bytes, ciphertext), view[:32]):
+            raise AuthProtocolSignatureError(f"Response signature mismatch for seq {seq}")
+        plaintext = bytearray(len(ciphertext))
+        AES.new(self.key, AES.MODE_CBC, iv=self.iv + seq_bytes).decrypt(ciphertext, output=plaintext)
+        return pkcs7_blank(plaintext)
+
+
+class BaseAuthProtocol:
+    """Session state and crypto shared by the sync and async TP-Link Auth Protocol transports"""
+
+    def __init__(
+            self,
+            address: str,
+            username: str,
+            password: str,
+            verify_signature: bool = True,
+            observer: Optional[ProtocolObserver] = None
+        ):
+        """Initialize the protocol state with device address, username, and password"""
         self.address    = address
         self.username   = username
         self.password   = password
-        self.key    : Optional[bytes] = None
-        self.iv     : Optional[bytes] = None
-        self.seq    : Optional[int]   = None
-        self.sig    : Optional[bytes] = None
+        self.verify_signature = verify_signature
+        self.observer   = observer or ProtocolObserver()
+        self.state: Optional[SessionState] = None
+        self._credentials = [(username, password)] + FALLBACK_CREDENTIALS
+        self._credentials_index = 0  # credentials that matched last, tried first on re-key
+        self._signature_failures = 0  # consecutive responses that failed verification
+
+
+    @staticmethod
+    def _session_lifetime(timeout: Optional[str]) -> int:
+        """Session lifetime in seconds from the handshake1 TIMEOUT cookie"""
+        try:
+            return int(timeout) if timeout else DEFAULT_SESSION_TIMEOUT
+        except ValueError:
+            return DEFAULT_SESSION_TIMEOUT
+
+
+    def _needs_refresh(self) -> bool:
+        """True once the session is close enough to expiry to be re-keyed"""
+        return self.state is not None and time.monotonic() >= self.state.refresh_at
+
+
+    def _is_expired(self) -> bool:
+        """True when there is no session or the device has already dropped it"""
+        return self.state is None or time.monotonic() >= self.state.expires_at
+
+
+    def _invalidate(self) -> None:
+        """Forget the session so the next request performs a handshake"""
+        self.state = None
+
+
+    def _postpone_refresh(self, state: SessionState, error: Exception) -> None:
+        """Keep a session whose re-key failed, and retry the re-key later"""
+        log.warning("Re-key of %s failed, keeping the current session: %s", self.address, error)
+        state.refresh_at = min(time.monotonic() + SESSION_REFRESH_RETRY, state.expires_at)
+
+
+    @staticmethod
+    def _cookie_header(cookies: Dict[str, str]) -> Optional[str]:
+        """Cookie header sending back the handshake1 cookies"""
+        return "; ".join(f"{name}={value}" for name, value in cookies.items()) or None
+
+
+    @staticmethod
+    def _method_label(method: str, params: Optional[Dict[str, Any]]) -> str:
+        """Round-trip label of a request; a multipleRequest is labelled by its sorted method set"""
+        if method == "multipleRequest" and params:
+            methods = sorted({request["method"] for request in params.get("requests", [])})
+            return "+".join(methods) or method
+        return method
 
 
     def calc_auth_hash(self, username: str, password: str) -> bytes:
         """Calculate the authentication hash based on username and password"""
-        return sha256(sha1(username.encode()) + sha1(password.encode()))
+        return calc_auth_hash(username, password)
 
 
-    def _request_raw(
+    def _build_request(
             self,
-            path: str,
-            data: bytes,
+            method: str,
             params: Optional[Dict[str, Any]] = None
-        ) -> bytes:
-        """Make a raw request to the device with the given path and data"""
-        url = f"http://{self.address}/app/{path}"
-        resp = self.session.post(url, data=data, timeout=2, params=params)
-        resp.raise_for_status()
-        return resp.content
-
-
-    def request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        """Make a request to the device using the specified method and parameters"""
-        if self.key is None:
-            self.initialize()
+        ) -> Tuple[int, bytes]:
+        """Build the encrypted request body for the given method and parameters; returns (seq, body)"""
+        if self.state is None:
+            raise AuthProtocolSessionError("Session is not initialized")
+        started = time.perf_counter()
         payload: Dict[str, Any] = {"method": method}
         if params:
             payload["params"] = params
         log.debug("Request: %s", payload)
-        encrypted = self._encrypt(json.dumps(payload).encode("utf-8"))
-        resp = self._request_raw("request", encrypted, params={"seq": self.seq})
-        result = json.loads(self._decrypt(resp).decode("utf-8"))
-        if result.get("error_code", 0) != 0:
+        encrypted = self.state.encrypt(json.dumps(payload).encode("utf-8"))
+        self.observer.stage(self.address, "encode", time.perf_counter() - started)
+        return encrypted
+
+
+    def _parse_response(self, seq: int, resp: bytes) -> Any:
+        """
+        Decrypt the response to the request sent with seq and return its result, raising on
+        device errors. Only session errors drop the session; other error codes fail just this request.
+        """
+        if self.state is None:
+            raise AuthProtocolSessionError("Session is not initialized")
+        started = time.perf_counter()
+        try:
+            result = json.loads(self.state.decrypt(seq, resp, self.verify_signature))
+        except AuthProtocolSignatureError as e:
+            self.observer.device_error(self.address, "signature")
+            self._signature_failures += 1
+            if self._signature_failures >= SIGNATURE_FAILURE_LIMIT:
+                self._signature_failures = 0
+                self._invalidate()
+                raise AuthProtocolSessionError(f"Session dropped after repeated failures: {e}") from e
+            raise
+        except ValueError as e:
+            # Invalid padding or JSON: the session keys don't match the device's
+            self._invalidate()
+            self.observer.device_error(self.address, "decode")
+            raise AuthProtocolSessionError("Failed to decrypt response") from e
+        self._signature_failures = 0
+        self.observer.stage(self.address, "decode", time.perf_counter() - started)
+        error_code = result.get("error_code", 0)
+        if error_code != 0:
             log.error("Error: %s", result)
-            self.key = None
-            raise AuthProtocolError(f"Error code: {result['error_code']}")
+            self.observer.device_error(self.address, str(error_code))
+            if error_code in SESSION_ERROR_CODES:
+                self._invalidate()
+                raise AuthProtocolSessionError(f"Error code: {error_code}", error_code)
+            raise AuthProtocolError(f"Error code: {error_code}", error_code)
         log.debug("Response: %s", result.get("result"))
         return result.get("result")
 
 
-    def _encrypt(self, data: bytes) -> bytes:
-        """Encrypt the given data using AES encryption"""
-        if self.seq is None:
-            raise ValueError("Sequence number (seq) is not initialized")
-        if self.sig is None:
-            raise ValueError("Signature (sig) is not initialized")
-        if self.key is None:
-            raise ValueError("Encryption key (key) is not initialized")
-        if self.iv is None:
-            raise ValueError("Initialization vector (iv) is not initialized")
-        self.seq += 1
-        seq_bytes = self.seq.to_bytes(4, "big", signed=True)
-        data_padded = pkcs7_pad(data)
-        cipher = AES.new(self.key, AES.MODE_CBC, iv=self.iv + seq_bytes)
-        ciphertext = cipher.encrypt(data_padded)
-        sig = sha256(self.sig + seq_bytes + ciphertext)
-        return sig + ciphertext
-
-
-    def _decrypt(self, data: bytes) -> bytes:
-        """Decrypt the given data using AES decryption"""
-        if self.seq is None:
-            raise ValueError("Sequence number (seq) is not initialized")
-        if self.sig is None:
-            raise ValueError("Signature (sig) is not initialized")
-        if self.key is None:
-            raise ValueError("Encryption key (key) is not initialized")
-        if self.iv is None:
-            raise ValueError("Initialization vector (iv) is not initialized")
-        seq_bytes = self.seq.to_bytes(4, "big", signed=True)
-        cipher = AES.new(self.key, AES.MODE_CBC, self.iv + seq_bytes)
-        # Only decrypt after signature (first 32 bytes)
-        plaintext = cipher.decrypt(data[32:])
-        return pkcs7_unpad(plaintext)
+    def _find_auth_hash(self, local_seed: bytes, remote_seed: bytes, server_hash: bytes) -> bytes:
+        """Return the auth hash of the credentials matching the handshake1 server hash"""
+        seeds = local_seed + remote_seed
+        count = len(self._credentials)
+        for offset in range(count):
+            index = (self._credentials_index + offset) % count
+            creds = self._credentials[index]
+            ah = calc_auth_hash(*creds)
+            # Constant-time compare
+            if secrets.compare_digest(sha256(seeds + ah), server_hash):
+                log.debug("Authenticated with %s", creds[0])
+                self._credentials_index = index
+                return ah
+        raise AuthProtocolError("Failed to authenticate")
+
+
+    def _derive_session(
+            self,
+            local_seed: bytes,
+            remote_seed: bytes,
+            auth_hash: bytes,
+            lifetime: int,
+            cookie: Optional[str]
+        ) -> SessionState:
+        """Session state derived from a completed handshake; the caller binds it"""
+        log.debug("Initialized, session for %s valid for %ds", self.address, lifetime)
+        return SessionState(local_seed, remote_seed, auth_hash, lifetime, cookie)
+
+
+class AuthProtocol(BaseAuthProtocol):
+    """
+    TP-Link Auth Protocol for communication with devices. Thread-safe: requests are
+    serialized because the session sequence number is shared between encrypt and decrypt.
+    """
+
+    def __init__(
+            self,
+            address: str,
+            username: str,
+            password: str,
+            verify_signature: bool = True,
+            observer: Optional[ProtocolObserver] = None,
+            timeout: float = 2
+        ):
+        """Initialize the AuthProtocol with device address, username, and password"""
+        # Imported here: only the synchronous client uses requests, the exporter doesn't
+        import http.cookiejar
+        import requests
+        super().__init__(address, username, password, verify_signature, observer)
+        self.requests   = requests  # the module, for its exceptions
+        self.session    = requests.Session()  # single keep-alive connection
+        # Session cookies are sent by hand from the session state, never from the jar
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        self.timeout    = timeout
+        self._lock      = threading.RLock()  # reentrant: request() may re-initialize
+
+
+    def _request_raw(
+            self,
+            path: str,
+            data: bytes,
+            params: Optional[Dict[str, Any]] = None,
+            method: Optional[str] = None,
+            cookie: Optional[str] = None
+        ) -> Tuple[bytes, Dict[str, str]]:
+        """Make a raw request to the device with the given path and data; returns (body, cookies)"""
+        url = f"http://{self.address}/app/{path}"
+        started = time.perf_counter()
+        headers = {"Cookie": cookie} if cookie else None
+        try:
+            resp = self.session.post(url, data=data, timeout=self.timeout, params=params, headers=headers)
+            resp.raise_for_status()
+        except self.requests.RequestException:
+            self.observer.device_error(self.address, "transport")
+            raise
+        self.observer.round_trip(
+            self.address, method or path, time.perf_counter() - started, len(data), len(resp.content))
+        return resp.content, resp.cookies.get_dict()
+
+
+    def request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Make a request to the device using the specified method and parameters"""
+        with self._lock:
+            if self._is_expired():
+                self.initialize()
+            elif self._needs_refresh():
+                state = self.state
+                try:
+                    self.initialize()
+                except Exception as e: # pylint: disable=broad-except
+                    self._postpone_refresh(state, e)
+            seq, encrypted = self._build_request(method, params)
+            try:
+                resp, _ = self._request_raw(
+                    "request", encrypted, params={"seq": seq},
+                    method=self._method_label(method, params), cookie=self.state.cookie)
+            except self.requests.HTTPError as e:
+                if e.response is not None and e.response.status_code in SESSION_HTTP_STATUSES:
+                    self._invalidate()
+                    raise AuthProtocolSessionError(f"Session rejected: {e}") from e
+                raise
+            return self._parse_response(seq, resp)
 
 
     def initialize(self):
         """Initialize the AuthProtocol by performing a handshake with the device"""
+        with self._lock:
+            started = time.perf_counter()
+            try:
+                state = self._handshake()
+            except Exception:
+                self.observer.handshake(self.address, time.perf_counter() - started, False)
+                raise
+            self.observer.handshake(self.address, time.perf_counter() - started, True)
+            self.state = state
+
+
+    def _handshake(self) -> SessionState:
+        """Perform handshake1/handshake2 and derive the new session; the current one is untouched"""
         local_seed = get_random_bytes(16)
-        resp = self._request_raw("handshake1", local_seed)
+        resp, cookies = self._request_raw("handshake1", local_seed)
+        lifetime = self._session_lifetime(cookies.get("TIMEOUT"))
+        cookie = self._cookie_header(cookies)
         remote_seed, server_hash = resp[:16], resp[16:]
-        auth_hash = None
-        for creds in [
-            (self.username, self.password),
-            ("", ""),
-            ("kasa@tp-link.net", "kasaSetup"),
-        ]:
-            ah = self.calc_auth_hash(*creds)
-            candidate = sha256(local_seed + remote_seed + ah)
-            # Constant-time compare
-            if secrets.compare_digest(candidate, server_hash):
-                auth_hash = ah
-                log.debug("Authenticated with %s", creds[0])
-                break
-        if not auth_hash:
-            raise AuthProtocolError("Failed to authenticate")
-        self._request_raw("handshake2", sha256(remote_seed + local_seed + auth_hash))
-        self.key = sha256(b"lsk" + local_seed + remote_seed + auth_hash)[:16]
-        ivseq = sha256(b"iv" + local_seed + remote_seed + auth_hash)
-        self.iv = ivseq[:12]
-        self.seq = int.from_bytes(ivseq[-4:], "big", signed=True)
-        self.sig = sha256(b"ldk" + local_seed + remote_seed + auth_hash)[:28]
-        log.debug("Initialized")
+        ah = self._find_auth_hash(local_seed, remote_seed, server_hash)
+        self._request_raw("handshake2", sha256(remote_seed + local_seed + ah), cookie=cookie)
+        return self._derive_session(local_seed, remote_seed, ah, lifetime, cookie)
+
+
+class AsyncAuthProtocol(BaseAuthProtocol):
+    """
+    TP-Link Auth Protocol over asyncio, for pollers running inside an event loop.
+    Uses one pooled keep-alive aiohttp connection per device; requests are serialized
+    because the session sequence number is shared between encrypt and decrypt.
+    Sessions nearing expiry are re-keyed in the background after a request, outside the
+    request lock, so polls keep using the current session during the rollover.
+    """
+
+    def __init__(
+            self,
+            address: str,
+            username: str,
+            password: str,
+            timeout: float = 2,
+            verify_signature: bool = True,
+            observer: Optional[ProtocolObserver] = None
+        ):
+        """Initialize the AsyncAuthProtocol with device address, username, and password"""
+        # Imported here: the device models (and settings validation) import this module early
+        import aiohttp
+        super().__init__(address, username, password, verify_signature, observer)
+        self.aiohttp    = aiohttp  # the module, for its client and exceptions
+        self.timeout    = timeout
+        self.session: Optional[aiohttp.ClientSession] = None  # created lazily on the running loop
+        self._lock      = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        """Return the HTTP session, creating it on first use"""
+        if self.session is None or self.session.closed:
+            aiohttp = self.aiohttp
+            self.session = aiohttp.ClientSession(
+                # One keep-alive connection per device; the strip only serves one at a time
+                connector=aiohttp.TCPConnector(limit=1, keepalive_timeout=30),
+                # Session cookies are sent by hand from the session state, never from a jar
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+
+    async def _request_raw(
+            self,
+            path: str,
+            data: bytes,
+            params: Optional[Dict[str, Any]] = None,
+            method: Optional[str] = None,
+            cookie: Optional[str] = None
+        ) -> Tuple[bytes, Dict[str, str]]:
+        """Make a raw request to the device with the given path and data; returns (body, cookies)"""
+        url = f"http://{self.address}/app/{path}"
+        started = time.perf_counter()
+        headers = {"Cookie": cookie} if cookie else None
+        try:
+            async with self._get_session().post(url, data=data, params=params, headers=headers) as resp:
+                resp.raise_for_status()
+                content = await resp.read()
+                cookies = {name: morsel.value for name, morsel in resp.cookies.items()}
+        except (self.aiohttp.ClientError, asyncio.TimeoutError):
+            self.observer.device_error(self.address, "transport")
+            raise
+        self.observer.round_trip(
+            self.address, method or path, time.perf_counter() - started, len(data), len(content))
+        return content, cookies
+
+
+    async def request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Make a request to the device using the specified method and parameters"""
+        async with self._lock:
+            if self._is_expired():
+                self.state = await self._initialize()
+            seq, encrypted = self._build_request(method, params)
+            try:
+                resp, _ = await self._request_raw(
+                    "request", encrypted, params={"seq": str(seq)},
+                    method=self._method_label(method, params), cookie=self.state.cookie)
+            except self.aiohttp.ClientResponseError as e:
+                if e.status in SESSION_HTTP_STATUSES:
+                    self._invalidate()
+                    raise AuthProtocolSessionError(f"Session rejected: {e}") from e
+                raise
+            result = self._parse_response(seq, resp)
+        if self._needs_refresh() and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return result
+
+
+    async def _refresh(self) -> None:
+        """
+        Re-key the session ahead of expiry. The handshake runs without the request lock and
+        the new session is only swapped in once complete; on failure the current one is kept.
+        """
+        state = self.state
+        try:
+            log.debug("Re-keying session for %s before expiry", self.address)
+            new_state = await self._initialize()
+            async with self._lock:
+                self.state = new_state
+        except Exception as e: # pylint: disable=broad-except
+            if state is not None and self.state is state:
+                self._postpone_refresh(state, e)
+        finally:
+            self._refresh_task = None
+
+
+    async def initialize(self):
+        """Initialize the AsyncAuthProtocol by performing a handshake with the device"""
+        async with self._lock:
+            self.state = await self._initialize()
+
+
+    async def _initialize(self) -> SessionState:
+        """Perform the handshake and return the new session; the caller binds it"""
+        started = time.perf_counter()
+        try:
+            state = await self._handshake()
+        except (Exception, asyncio.CancelledError):
+            # Cancelled too, e.g. by the poll deadline
+            self.observer.handshake(self.address, time.perf_counter() - started, False)
+            raise
+        self.observer.handshake(self.address, time.perf_counter() - started, True)
+        return state
+
+
+    async def _handshake(self) -> SessionState:
+        """Perform handshake1/handshake2 and derive the new session; the current one is untouched"""
+        local_seed = get_random_bytes(16)
+        resp, cookies = await self._request_raw("handshake1", local_seed)
+        lifetime = self._session_lifetime(cookies.get("TIMEOUT"))
+        cookie = self._cookie_header(cookies)
+        remote_seed, server_hash = resp[:16], resp[16:]
+        ah = self._find_auth_hash(local_seed, remote_seed, server_hash)
+        await self._request_raw("handshake2", sha256(remote_seed + local_seed + ah), cookie=cookie)
+        return self._derive_session(local_seed, remote_seed, ah, lifetime, cookie)
+
+
+    async def close(self) -> None:
+        """Close the pooled HTTP connection"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
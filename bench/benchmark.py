@@ -0,0 +1,306 @@
+"""
+# bench/benchmark.py
+Load-test benchmark against simulated strips (bench/simulator.py): handshakes per second,
+end-to-end poll latency, exporter startup time, CPU/RSS and /metrics render time as the
+device count grows.
+
+Run from the repository root:
+    python -m bench.benchmark --devices 1,10,50 --latency 0.05 --json bench_output.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, FrozenSet, List, Optional
+import requests
+from auth_protocol import AsyncAuthProtocol
+from device_config import DeviceConfig, ScheduleSettings
+from device_models import get_model
+from fleet import Fleet, FleetDevice, PollOutcome
+
+USERNAME = "user@example.com"
+PASSWORD = "password"
+EXPORTER_URL = "http://127.0.0.1:8882/metrics"
+READY_URL = "http://127.0.0.1:8882/ready"
+# Families polled every round: those of the simulated P304M but the device info
+POLL_FAMILIES = frozenset(get_model("P304M").families) - {"info"}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of the values"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10) -> None:
+    """Wait until something accepts connections on host:port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.post(f"http://{host}:{port}/", timeout=0.5)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on {host}:{port}")
+
+
+def start_simulator(args: argparse.Namespace, devices: int) -> subprocess.Popen:
+    """Start the simulated strips in their own process, so they don't share our CPU"""
+    command = [
+        sys.executable, "-m", "bench.simulator",
+        "--devices", str(devices), "--base-port", str(args.base_port),
+        "--plugs", str(args.plugs), "--latency", str(args.latency),
+        "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+        "--session-timeout", str(args.session_timeout),
+        "--username", USERNAME, "--password", PASSWORD,
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port("127.0.0.1", args.base_port + devices - 1)
+    return process
+
+
+def device_configs(args: argparse.Namespace, devices: int) -> List[DeviceConfig]:
+    """Configs of the simulated strips"""
+    return [DeviceConfig(f"127.0.0.1:{args.base_port + i}", USERNAME, PASSWORD) for i in range(devices)]
+
+
+async def bench_handshakes(configs: List[DeviceConfig], concurrency: int) -> float:
+    """Full handshakes per second against every strip"""
+    semaphore = asyncio.Semaphore(concurrency)
+    protocols = [AsyncAuthProtocol(c.ip_address, c.username, c.password) for c in configs]
+
+    async def handshake(protocol: AsyncAuthProtocol) -> None:
+        async with semaphore:
+            await protocol.initialize()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handshake(p) for p in protocols))
+    elapsed = time.perf_counter() - started
+    await asyncio.gather(*(p.close() for p in protocols))
+    return len(protocols) / elapsed
+
+
+async def bench_polls(configs: List[DeviceConfig], concurrency: int, rounds: int) -> Dict[str, float]:
+    """Per-device and per-cycle poll latency over the fleet scheduler"""
+    fleet = Fleet(configs, concurrency, ScheduleSettings())
+    latencies: List[float] = []
+    cycles: List[float] = []
+    failures = 0
+
+    async def poll(device: FleetDevice, families: FrozenSet[str]) -> PollOutcome:
+        nonlocal failures
+        started = time.perf_counter()
+        result = await device.tapo.poll(families)
+        latencies.append(time.perf_counter() - started)
+        failures += not result['ok']
+        return PollOutcome(result['answered'], result['failed'])
+
+    # Warm-up round performs the handshakes
+    await fleet.run_each(poll, POLL_FAMILIES)
+    latencies.clear()
+    failures = 0
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await fleet.run_each(poll, POLL_FAMILIES)
+        cycles.append(time.perf_counter() - started)
+    await fleet.close()
+    return {
+        "poll_p50_ms": percentile(latencies, 50) * 1000,
+        "poll_p95_ms": percentile(latencies, 95) * 1000,
+        "poll_max_ms": max(latencies) * 1000,
+        "cycle_p50_ms": percentile(cycles, 50) * 1000,
+        "poll_failures": failures,
+    }
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a process (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/stat", encoding="ascii") as fp:
+            fields = fp.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MiB (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def exporter_env(args: argparse.Namespace, devices_file: str) -> Dict[str, str]:
+    """Environment of a prometheus.py run against the strips"""
+    return dict(os.environ, TAPO_DEVICES_FILE=devices_file, TAPO_USERNAME=USERNAME,
+                TAPO_PASSWORD=PASSWORD, TAPO_MAX_CONCURRENCY=str(args.concurrency))
+
+
+def write_devices_file(configs: List[DeviceConfig]) -> str:
+    """Temporary JSON device list of the strips; the caller removes it"""
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fp:
+        json.dump({"devices": [{"ip_address": c.ip_address} for c in configs]}, fp)
+        return fp.name
+
+
+def bench_startup(args: argparse.Namespace, configs: List[DeviceConfig]) -> Dict[str, Any]:
+    """
+    Start prometheus.py startup_runs times: seconds until it answers HTTP (listening) and
+    until /ready turns 200 (every strip polled once); medians over the runs
+    """
+    devices_file = write_devices_file(configs)
+    listening, ready = [], []
+    try:
+        for _ in range(args.startup_runs):
+            started = time.perf_counter()
+            exporter = subprocess.Popen([sys.executable, "prometheus.py"], env=exporter_env(args, devices_file),
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                deadline = time.monotonic() + 60
+                answered = None
+                while True:
+                    if time.monotonic() > deadline or exporter.poll() is not None:
+                        raise RuntimeError("Exporter did not turn ready in time")
+                    try:
+                        status = requests.get(READY_URL, timeout=5).status_code
+                        if answered is None:
+                            answered = time.perf_counter() - started
+                        if status == 200:
+                            break
+                    except requests.RequestException:
+                        pass
+                    time.sleep(0.01)
+                listening.append(answered)
+                ready.append(time.perf_counter() - started)
+            finally:
+                exporter.terminate()
+                exporter.wait()
+    finally:
+        os.unlink(devices_file)
+    return {
+        "startup_listening_s": statistics.median(listening),
+        "startup_ready_s": statistics.median(ready),
+    }
+
+
+def bench_exporter(args: argparse.Namespace, configs: List[DeviceConfig]) -> Dict[str, Any]:
+    """Run prometheus.py against the strips: CPU and RSS while polling, and /metrics render time"""
+    devices_file = write_devices_file(configs)
+    env = exporter_env(args, devices_file)
+    started = time.perf_counter()
+    exporter = subprocess.Popen([sys.executable, "prometheus.py"], env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        expected = len(configs) * args.plugs
+        deadline = time.monotonic() + 60
+        while True:
+            if time.monotonic() > deadline or exporter.poll() is not None:
+                raise RuntimeError("Exporter did not export every plug in time")
+            try:
+                body = requests.get(EXPORTER_URL, timeout=5).text
+                if body.count("tapo_p304m_plug_power_mw{") >= expected:
+                    break
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        ready_s = time.perf_counter() - started
+
+        cpu_before = process_cpu_seconds(exporter.pid)
+        time.sleep(args.window)
+        cpu_after = process_cpu_seconds(exporter.pid)
+        cpu_pct = (None if cpu_before is None or cpu_after is None
+                   else (cpu_after - cpu_before) / args.window * 100)
+
+        renders = []
+        size = 0
+        for _ in range(args.scrapes):
+            render_started = time.perf_counter()
+            response = requests.get(EXPORTER_URL, timeout=10)
+            renders.append(time.perf_counter() - render_started)
+            size = len(response.content)
+        return {
+            "exporter_ready_s": ready_s,
+            "exporter_cpu_pct": cpu_pct,
+            "exporter_rss_mb": process_rss_mb(exporter.pid),
+            "metrics_p50_ms": percentile(renders, 50) * 1000,
+            "metrics_p95_ms": percentile(renders, 95) * 1000,
+            "metrics_bytes": size,
+        }
+    finally:
+        exporter.terminate()
+        exporter.wait()
+        os.unlink(devices_file)
+
+
+def run_benchmark(args: argparse.Namespace, devices: int) -> Dict[str, Any]:
+    """All measurements for one fleet size"""
+    simulator = start_simulator(args, devices)
+    try:
+        configs = device_configs(args, devices)
+        result: Dict[str, Any] = {"devices": devices}
+        result["handshakes_per_s"] = asyncio.run(bench_handshakes(configs, args.concurrency))
+        result.update(asyncio.run(bench_polls(configs, args.concurrency, args.rounds)))
+        if not args.skip_exporter:
+            result.update(bench_startup(args, configs))
+            result.update(bench_exporter(args, configs))
+        return result
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+
+def format_value(value: Any) -> str:
+    """Table cell for a measurement"""
+    if value is None:
+        return "n/a"
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Command line options"""
+    parser = argparse.ArgumentParser(description="Exporter benchmark against simulated strips")
+    parser.add_argument("--devices", default="1,10,50", help="comma-separated fleet sizes")
+    parser.add_argument("--base-port", type=int, default=19000)
+    parser.add_argument("--plugs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated device latency (sec)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--session-timeout", type=int, default=86400)
+    parser.add_argument("--concurrency", type=int, default=16, help="strips polled at once")
+    parser.add_argument("--rounds", type=int, default=5, help="measured poll rounds")
+    parser.add_argument("--window", type=float, default=10.0, help="exporter CPU sampling window (sec)")
+    parser.add_argument("--scrapes", type=int, default=20, help="timed /metrics requests")
+    parser.add_argument("--startup-runs", type=int, default=3, help="timed exporter startups")
+    parser.add_argument("--skip-exporter", action="store_true", help="skip the prometheus.py run")
+    parser.add_argument("--json", help="also write the results to this file")
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    args = parse_args()
+    results = [run_benchmark(args, int(n)) for n in args.devices.split(",")]
+    columns = list(results[0])
+    print(" | ".join(columns))
+    for result in results:
+        print(" | ".join(format_value(result.get(column)) for column in columns))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+# bench/simulator.py
+Simulated Tapo P304M strips speaking the handshake1/handshake2/request protocol of
+AuthProtocol, so the exporter can be benchmarked without physical devices.
+
+Run from the repository root:
+    python -m bench.simulator --devices 10 --base-port 19000 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+import time
+from base64 import b64encode
+from typing import Any, Dict, List, Optional
+from aiohttp import web
+from Crypto.Cipher import AES
+from auth_protocol import sha1, sha256, pkcs7_pad, pkcs7_unpad
+
+log = logging.getLogger(__name__)
+
+SESSION_COOKIE = "TP_SESSIONID"
+SESSION_TIMEOUT_ERROR = 9999
+
+
+def b64(text: str) -> str:
+    """Base64-encode text the way the device encodes nicknames"""
+    return b64encode(text.encode("utf-8")).decode("ascii")
+
+
+class SimulatedSession:
+    """Handshake seeds and derived keys of one simulated session"""
+
+    def __init__(self, local_seed: bytes, remote_seed: bytes, auth_hash: bytes, timeout: int):
+        self.local_seed     = local_seed
+        self.remote_seed    = remote_seed
+        self.auth_hash      = auth_hash
+        self.expires_at     = time.monotonic() + timeout
+        self.key: Optional[bytes] = None
+        self.iv: Optional[bytes] = None
+        self.sig: Optional[bytes] = None
+
+
+    def derive(self) -> None:
+        """Derive the session keys once handshake2 is verified"""
+        seeds = self.local_seed + self.remote_seed + self.auth_hash
+        self.key = sha256(b"lsk" + seeds)[:16]
+        self.iv = sha256(b"iv" + seeds)[:12]
+        self.sig = sha256(b"ldk" + seeds)[:28]
+
+
+    def decrypt(self, seq: int, body: bytes) -> Dict[str, Any]:
+        """Verify and decrypt a request body"""
+        seq_bytes = seq.to_bytes(4, "big", signed=True)
+        if sha256(self.sig + seq_bytes + body[32:]) != body[:32]:
+            raise ValueError("Bad request signature")
+        cipher = AES.new(self.key, AES.MODE_CBC, iv=self.iv + seq_bytes)
+        return json.loads(pkcs7_unpad(cipher.decrypt(body[32:])))
+
+
+    def encrypt(self, seq: int, payload: Dict[str, Any]) -> bytes:
+        """Encrypt and sign a response body for the request sent with seq"""
+        seq_bytes = seq.to_bytes(4, "big", signed=True)
+        cipher = AES.new(self.key, AES.MODE_CBC, iv=self.iv + seq_bytes)
+        ciphertext = cipher.encrypt(pkcs7_pad(json.dumps(payload).encode("utf-8")))
+        return sha256(self.sig + seq_bytes + ciphertext) + ciphertext
+
+
+# Methods each simulated model does not know (answered with -40210)
+UNSUPPORTED_METHODS = {
+    "P304M": {"get_energy_usage"},
+    "P300": {"get_energy_usage", "get_realtime"},
+    "P110": {"get_child_device_list", "get_child_device_component_list", "get_realtime", "control_child"},
+}
+
+
+class SimulatedStrip:
+    """
+    One simulated P304M strip with configurable plugs, latency, errors and session expiry.
+    As a P300 it has no energy monitoring; as a P110 it is a single plug (the first plug).
+    """
+
+    def __init__(
+            self,
+            index: int,
+            username: str,
+            password: str,
+            plugs: int = 3,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            error_rate: float = 0.0,
+            error_code: int = -1,
+            session_timeout: int = 86400,
+            model: str = "P304M"
+        ):
+        self.index              = index
+        self.model              = model
+        self.auth_hash          = sha256(sha1(username.encode()) + sha1(password.encode()))
+        self.latency            = latency
+        self.jitter             = jitter
+        self.error_rate         = error_rate
+        self.error_code         = error_code
+        self.session_timeout    = session_timeout
+        self.sessions: Dict[str, SimulatedSession] = {}
+        self.requests           = 0
+        self.handshakes         = 0
+        self.device_id          = f"SIM{index:04d}" if model == "P304M" else f"SIM{model}{index:04d}"
+        self.plugs = [
+            {
+                "device_id": f"{self.device_id}PLUG{position:02d}",
+                "position": position,
+                "nickname": b64(f"Plug {position}"),
+                "device_on": True,
+                "on_time": 0,
+                "overcurrent_status": "normal",
+                "overheat_status": "normal",
+                "charging_status": "normal",
+            }
+            for position in range(1, plugs + 1)
+        ]
+        self.power_mw = [random.randint(0, 100000) for _ in self.plugs]
+        self.total_wh = [0.0 for _ in self.plugs]
+        self.started = time.monotonic()
+
+
+    async def _delay(self) -> None:
+        """Simulated device processing and network latency"""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+    def _session(self, request: web.Request) -> Optional[SimulatedSession]:
+        """Session of the request cookie, if any"""
+        return self.sessions.get(request.cookies.get(SESSION_COOKIE, ""))
+
+
+    async def handshake1(self, request: web.Request) -> web.Response:
+        """Answer handshake1 with remote seed and server hash, and open a session"""
+        await self._delay()
+        local_seed = await request.read()
+        now = time.monotonic()
+        self.sessions = {sid: s for sid, s in self.sessions.items() if s.expires_at > now}
+        remote_seed = os.urandom(16)
+        session_id = secrets.token_hex(16)
+        self.sessions[session_id] = SimulatedSession(
+            local_seed, remote_seed, self.auth_hash, self.session_timeout)
+        self.handshakes += 1
+        response = web.Response(body=remote_seed + sha256(local_seed + remote_seed + self.auth_hash))
+        response.set_cookie(SESSION_COOKIE, session_id)
+        response.set_cookie("TIMEOUT", str(self.session_timeout))
+        return response
+
+
+    async def handshake2(self, request: web.Request) -> web.Response:
+        """Verify the client hash and derive the session keys"""
+        await self._delay()
+        session = self._session(request)
+        body = await request.read()
+        if session is None or body != sha256(session.remote_seed + session.local_seed + session.auth_hash):
+            return web.Response(status=403)
+        session.derive()
+        return web.Response()
+
+
+    async def request(self, request: web.Request) -> web.Response:
+        """Decrypt a request, dispatch its method and return the encrypted response"""
+        await self._delay()
+        session = self._session(request)
+        if session is None or session.key is None:
+            return web.Response(status=403)
+        seq = int(request.query["seq"])
+        try:
+            payload = session.decrypt(seq, await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        self.requests += 1
+        if time.monotonic() >= session.expires_at:
+            response = {"error_code": SESSION_TIMEOUT_ERROR}
+        elif self.error_rate and random.random() < self.error_rate:
+            response = {"error_code": self.error_code}
+        else:
+            response = self._dispatch(payload)
+        return web.Response(body=session.encrypt(seq, response))
+
+
+    def _dispatch(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Answer one method, or every method of a multipleRequest"""
+        method = payload.get("method")
+        if method == "multipleRequest":
+            responses = []
+            for sub_request in payload.get("params", {}).get("requests", []):
+                sub_response = self._dispatch(sub_request)
+                sub_response["method"] = sub_request.get("method")
+                responses.append(sub_response)
+            return {"error_code": 0, "result": {"responses": responses}}
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None or method in UNSUPPORTED_METHODS[self.model]:
+            return {"error_code": -40210}
+        return {"error_code": 0, "result": handler(payload.get("params") or {})}
+
+
+    def _method_get_device_info(self, _params) -> Dict[str, Any]:
+        info = {
+            "device_id": self.device_id,
+            "fw_ver": "1.0.3 Build 240605 Rel.091502",
+            "hw_id": "SIMHW0000",
+            "ip": "127.0.0.1",
+            "type": "SMART.TAPOPLUG",
+            "model": self.model,
+            "nickname": b64(f"Simulated strip {self.index}"),
+            "description": b64(f"Simulated {self.model}"),
+        }
+        if self.model == "P110":
+            info.update(device_on=self.plugs[0]["device_on"], overheated=False,
+                        on_time=int(time.monotonic() - self.started))
+        return info
+
+
+    def _method_set_device_info(self, params) -> Dict[str, Any]:
+        if self.model == "P110" and "device_on" in params:
+            self.plugs[0]["device_on"] = bool(params["device_on"])
+        return {}
+
+
+    def _method_get_energy_usage(self, _params) -> Dict[str, Any]:
+        self.power_mw[0] = max(0, self.power_mw[0] + random.randint(-5000, 5000))
+        return {"current_power": self.power_mw[0], "today_energy": 0, "month_energy": 0,
+                "today_runtime": 0, "month_runtime": 0}
+
+
+    def _method_get_device_usage(self, _params) -> Dict[str, Any]:
+        minutes = int((time.monotonic() - self.started) / 60)
+        period = {"today": minutes, "past7": minutes, "past30": minutes}
+        return {"power_usage": dict(period), "saved_power": dict(period), "time_usage": dict(period)}
+
+
+    def _method_get_child_device_list(self, _params) -> Dict[str, Any]:
+        on_time = int(time.monotonic() - self.started)
+        plugs = [dict(plug, on_time=on_time) for plug in self.plugs]
+        return {"child_device_list": plugs, "start_index": 0, "sum": len(plugs)}
+
+
+    def _method_get_child_device_component_list(self, _params) -> Dict[str, Any]:
+        return {
+            "child_component_list": [
+                {"device_id": plug["device_id"],
+                 "component_list": [{"id": "device", "ver_code": 2}, {"id": "energy_monitoring", "ver_code": 2}]}
+                for plug in self.plugs
+            ],
+            "start_index": 0,
+            "sum": len(self.plugs),
+        }
+
+
+    def _method_get_realtime(self, _params) -> Dict[str, Any]:
+        data = []
+        for i, _ in enumerate(self.plugs):
+            # Random walk so consecutive samples differ
+            self.power_mw[i] = max(0, self.power_mw[i] + random.randint(-5000, 5000))
+            self.total_wh[i] += self.power_mw[i] / 1000 / 3600
+            data.append({
+                "current_ma": self.power_mw[i] // 230,
+                "voltage_mv": 230000 + random.randint(-2000, 2000),
+                "power_mw": self.power_mw[i],
+                "total_wh": int(self.total_wh[i]),
+            })
+        # The device lists realtime data in reverse plug order
+        return {"data": list(reversed(data))}
+
+
+    def _method_control_child(self, params) -> Dict[str, Any]:
+        plug = next((p for p in self.plugs if p["device_id"] == params.get("device_id")), None)
+        request = params.get("requestData") or {}
+        if plug is None or request.get("method") != "set_device_info":
+            return {"responseData": {"error_code": -40210}}
+        if "device_on" in request.get("params", {}):
+            plug["device_on"] = bool(request["params"]["device_on"])
+        return {"responseData": {"error_code": 0, "result": {}}}
+
+
+    def app(self) -> web.Application:
+        """aiohttp application serving this strip"""
+        application = web.Application()
+        application.add_routes([
+            web.post("/app/handshake1", self.handshake1),
+            web.post("/app/handshake2", self.handshake2),
+            web.post("/app/request", self.request),
+        ])
+        return application
+
+
+async def serve(strips: List[SimulatedStrip], host: str, base_port: int) -> List[web.AppRunner]:
+    """Serve each strip on its own port, starting at base_port"""
+    runners = []
+    for offset, strip in enumerate(strips):
+        runner = web.AppRunner(strip.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, base_port + offset).start()
+        runners.append(runner)
+    return runners
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Command line options"""
+    parser = argparse.ArgumentParser(description="Simulated Tapo P304M strips")
+    parser.add_argument("--devices", type=int, default=1, help="number of strips")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=19000, help="port of the first strip")
+    parser.add_argument("--plugs", type=int, default=3, help="plugs per strip")
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request (sec)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency (sec)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing")
+    parser.add_argument("--error-code", type=int, default=-1, help="error code of failing requests")
+    parser.add_argument("--session-timeout", type=int, default=86400, help="session lifetime (sec)")
+    parser.add_argument("--model", choices=sorted(UNSUPPORTED_METHODS), default="P304M")
+    parser.add_argument("--username", default="user@example.com")
+    parser.add_argument("--password", default="password")
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Start the strips and serve until cancelled"""
+    strips = [
+        SimulatedStrip(
+            index, args.username, args.password, plugs=args.plugs, latency=args.latency,
+            jitter=args.jitter, error_rate=args.error_rate, error_code=args.error_code,
+            session_timeout=args.session_timeout, model=args.model)
+        for index in range(args.devices)
+    ]
+    runners = await serve(strips, args.host, args.base_port)
+    log.info("Serving %d simulated strip(s) on %s:%d-%d",
+             len(strips), args.host, args.base_port, args.base_port + len(strips) - 1)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(run(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,55 @@
+"""# command_queue.py"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class CommandQueue:
+    """
+    Write commands of one device, executed one at a time in submission order. A command for
+    a target that is still queued replaces it (last write wins) and shares its result, so
+    rapid toggles of one plug cost one device request. Commands go through the device's
+    protocol lock like the polls, so they never interleave with a poll on the session.
+    """
+
+    def __init__(self, execute: Callable[[Hashable, Any], Awaitable[Any]]):
+        self.execute                                                    = execute
+        # target -> (command, futures of every caller waiting on it); dicts keep FIFO order
+        self._pending: Dict[Hashable, Tuple[Any, List[asyncio.Future]]] = {}
+        self._worker: Optional[asyncio.Task]                            = None
+
+
+    async def submit(self, target: Hashable, command: Any) -> Any:
+        """Queue a command for the target and wait for its (or its replacement's) result"""
+        future = asyncio.get_running_loop().create_future()
+        queued = self._pending.get(target)
+        if queued is None:
+            self._pending[target] = (command, [future])
+        else:
+            log.debug("Coalescing command for %s: %r replaces %r", target, command, queued[0])
+            self._pending[target] = (command, queued[1] + [future])
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        return await future
+
+
+    async def _run(self) -> None:
+        """Execute queued commands until the queue is empty"""
+        try:
+            while self._pending:
+                target = next(iter(self._pending))
+                command, waiters = self._pending.pop(target)
+                try:
+                    result = await self.execute(target, command)
+                except Exception as e: # pylint: disable=broad-except
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                    continue
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(result)
+        finally:
+            self._worker = None
@@ -0,0 +1,373 @@
+"""# device_config.py"""
+import json
+import logging
+import zlib
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Mapping, Optional
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MODEL = "P304M"
+# Models registered in device_models, named here so settings are checked without loading
+# the device layer (and its crypto dependencies) before the port is bound
+SUPPORTED_MODELS = ("P110", "P115", "P300", "P304M")
+DEFAULT_SERIES_MAX_AGE = 12
+DEFAULT_AGGREGATION_WINDOW = 60.0
+
+
+@dataclass(frozen=True)
+class DeviceConfig:
+    """Connection settings for one Tapo device, and its model (see device_models)"""
+    ip_address: str
+    username: str
+    password: str
+    model: str = DEFAULT_MODEL
+
+
+def _parse_device_file(path: str, username: str, password: str, model: str) -> List[DeviceConfig]:
+    """
+    Parse a JSON device list, either a list or {"devices": [...]}, e.g.
+    [{"ip_address": "192.168.1.10"}, {"ip_address": "192.168.1.11", "username": "..", "password": "..",
+    "model": "P110"}]
+    Devices without their own credentials fall back to TAPO_USERNAME/TAPO_PASSWORD, devices
+    without a model to TAPO_MODEL.
+    """
+    with open(path, encoding="utf-8") as fp:
+        data: Any = json.load(fp)
+    if isinstance(data, dict):
+        data = data.get("devices", [])
+    if not isinstance(data, list):
+        raise ValueError(f"Device file {path} must contain a list of devices")
+
+    configs = []
+    for i, entry in enumerate(data):
+        if not isinstance(entry, dict) or not entry.get("ip_address"):
+            raise ValueError(f"Device #{i} in {path} has no ip_address")
+        device_username = entry.get("username") or username
+        device_password = entry.get("password") or password
+        if not device_username or not device_password:
+            raise ValueError(f"Device {entry['ip_address']} has no credentials and no "
+                             "TAPO_USERNAME/TAPO_PASSWORD default is set")
+        device_model = (entry.get("model") or model).upper()
+        configs.append(DeviceConfig(entry["ip_address"], device_username, device_password, device_model))
+    return configs
+
+
+def load_device_configs(environ: Mapping[str, str]) -> List[DeviceConfig]:
+    """
+    Build the device list from the environment.
+    TAPO_DEVICES_FILE points to a JSON device list with optional per-device credentials;
+    otherwise TAPO_IP_ADDRESS holds one or more comma-separated addresses sharing
+    TAPO_USERNAME/TAPO_PASSWORD. TAPO_MODEL is the model of devices without their own.
+    """
+    username = environ.get("TAPO_USERNAME", "")
+    password = environ.get("TAPO_PASSWORD", "")
+    model = (environ.get("TAPO_MODEL", "") or DEFAULT_MODEL).upper()
+    devices_file = environ.get("TAPO_DEVICES_FILE")
+
+    if devices_file:
+        configs = _parse_device_file(devices_file, username, password, model)
+    else:
+        required = ["TAPO_USERNAME", "TAPO_PASSWORD", "TAPO_IP_ADDRESS"]
+        missing = [var for var in required if not environ.get(var)]
+        if missing:
+            raise ValueError(f"Missing required environment variable(s): {', '.join(missing)}")
+        addresses = [a.strip() for a in environ["TAPO_IP_ADDRESS"].split(",") if a.strip()]
+        configs = [DeviceConfig(address, username, password, model) for address in addresses]
+
+    if not configs:
+        raise ValueError("No devices configured")
+
+    seen: Dict[str, int] = {}
+    for config in configs:
+        seen[config.ip_address] = seen.get(config.ip_address, 0) + 1
+    duplicates = [address for address, count in seen.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Duplicate device address(es): {', '.join(duplicates)}")
+    return configs
+
+
+def _load_positive_int(environ: Mapping[str, str], name: str, default: int) -> int:
+    """Read an integer setting of at least 1 from the environment"""
+    value = environ.get(name, "")
+    if not value:
+        return default
+    try:
+        number = int(value)
+    except ValueError as e:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from e
+    if number < 1:
+        raise ValueError(f"{name} must be at least 1")
+    return number
+
+
+def load_max_concurrency(environ: Mapping[str, str]) -> int:
+    """Number of strips polled at the same time (TAPO_MAX_CONCURRENCY)"""
+    return _load_positive_int(environ, "TAPO_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+
+
+def load_series_max_age(environ: Mapping[str, str]) -> int:
+    """Poll cycles after which series that were not refreshed are removed (TAPO_SERIES_MAX_AGE)"""
+    return _load_positive_int(environ, "TAPO_SERIES_MAX_AGE", DEFAULT_SERIES_MAX_AGE)
+
+
+def load_verify_signature(environ: Mapping[str, str]) -> bool:
+    """
+    Whether device responses must carry a valid signature (TAPO_VERIFY_SIGNATURE, default true).
+    Only turn it off for firmware that signs responses differently; they are still decrypted.
+    """
+    value = environ.get("TAPO_VERIFY_SIGNATURE", "").strip().lower()
+    if not value:
+        return True
+    if value not in ("true", "false", "1", "0"):
+        raise ValueError(f"TAPO_VERIFY_SIGNATURE must be true or false, got {value!r}")
+    return value in ("true", "1")
+
+
+COLLECTION_MODES = ("poll", "scrape")
+
+
+@dataclass(frozen=True)
+class CollectionSettings:
+    """How device metrics are collected: fixed-interval polling or fetch-on-scrape"""
+    mode: str = "poll"
+    cache_ttl: float = 5.0
+    scrape_timeout: float = 10.0
+
+
+def _load_positive_float(environ: Mapping[str, str], name: str, default: float) -> float:
+    """Read a positive float setting from the environment"""
+    value = environ.get(name, "")
+    if not value:
+        return default
+    try:
+        number = float(value)
+    except ValueError as e:
+        raise ValueError(f"{name} must be a number, got {value!r}") from e
+    if number <= 0:
+        raise ValueError(f"{name} must be positive")
+    return number
+
+
+def load_aggregation_window(environ: Mapping[str, str]) -> float:
+    """Seconds of realtime samples summarized by the plug window series (TAPO_AGGREGATION_WINDOW)"""
+    return _load_positive_float(environ, "TAPO_AGGREGATION_WINDOW", DEFAULT_AGGREGATION_WINDOW)
+
+
+def load_collection_settings(environ: Mapping[str, str]) -> CollectionSettings:
+    """
+    Collection mode settings: TAPO_COLLECTION_MODE (poll or scrape), and for scrape mode
+    TAPO_CACHE_TTL (seconds a fetch is reused) and TAPO_SCRAPE_TIMEOUT (seconds a scrape waits)
+    """
+    defaults = CollectionSettings()
+    mode = environ.get("TAPO_COLLECTION_MODE", "") or defaults.mode
+    if mode not in COLLECTION_MODES:
+        raise ValueError(f"TAPO_COLLECTION_MODE must be one of {', '.join(COLLECTION_MODES)}")
+    return CollectionSettings(
+        mode=mode,
+        cache_ttl=_load_positive_float(environ, "TAPO_CACHE_TTL", defaults.cache_ttl),
+        scrape_timeout=_load_positive_float(environ, "TAPO_SCRAPE_TIMEOUT", defaults.scrape_timeout),
+    )
+
+
+@dataclass(frozen=True)
+class ScheduleSettings:
+    """Per-family poll intervals, request timeout, per-poll deadline and failure backoff (seconds)"""
+    realtime_interval: float = 5.0
+    usage_interval: float = 60.0
+    info_interval: float = 300.0
+    request_timeout: float = 2.0
+    poll_deadline: float = 8.0
+    backoff_max: float = 300.0
+
+    @property
+    def intervals(self) -> Dict[str, float]:
+        """Poll interval of each metric family"""
+        return {
+            "realtime": self.realtime_interval,
+            "usage": self.usage_interval,
+            "info": self.info_interval,
+        }
+
+
+def load_schedule_settings(environ: Mapping[str, str]) -> ScheduleSettings:
+    """
+    Scheduler settings: TAPO_POLL_INTERVAL (realtime power), TAPO_USAGE_INTERVAL
+    (get_device_usage), TAPO_INFO_INTERVAL (get_device_info), TAPO_REQUEST_TIMEOUT,
+    TAPO_POLL_DEADLINE (budget of one device poll) and TAPO_BACKOFF_MAX
+    """
+    defaults = ScheduleSettings()
+    return ScheduleSettings(
+        realtime_interval=_load_positive_float(environ, "TAPO_POLL_INTERVAL", defaults.realtime_interval),
+        usage_interval=_load_positive_float(environ, "TAPO_USAGE_INTERVAL", defaults.usage_interval),
+        info_interval=_load_positive_float(environ, "TAPO_INFO_INTERVAL", defaults.info_interval),
+        request_timeout=_load_positive_float(environ, "TAPO_REQUEST_TIMEOUT", defaults.request_timeout),
+        poll_deadline=_load_positive_float(environ, "TAPO_POLL_DEADLINE", defaults.poll_deadline),
+        backoff_max=_load_positive_float(environ, "TAPO_BACKOFF_MAX", defaults.backoff_max),
+    )
+
+
+PUSH_FORMATS = ("remote_write", "text")
+
+
+@dataclass(frozen=True)
+class PushSettings:
+    """High-frequency sampling pushed in batches; disabled while url is None"""
+    url: Optional[str] = None
+    format: str = "remote_write"
+    sample_interval: float = 1.0
+    flush_interval: float = 15.0
+    buffer_size: int = 900
+
+
+def load_push_settings(environ: Mapping[str, str]) -> PushSettings:
+    """
+    Push mode settings: TAPO_PUSH_URL (enables it), TAPO_PUSH_FORMAT (remote_write or text),
+    TAPO_SAMPLE_INTERVAL (realtime poll interval while pushing), TAPO_PUSH_INTERVAL (seconds
+    between flushes) and TAPO_SAMPLE_BUFFER (samples kept per plug series until pushed)
+    """
+    defaults = PushSettings()
+    push_format = environ.get("TAPO_PUSH_FORMAT", "") or defaults.format
+    if push_format not in PUSH_FORMATS:
+        raise ValueError(f"TAPO_PUSH_FORMAT must be one of {', '.join(PUSH_FORMATS)}")
+    return PushSettings(
+        url=environ.get("TAPO_PUSH_URL", "") or None,
+        format=push_format,
+        sample_interval=_load_positive_float(environ, "TAPO_SAMPLE_INTERVAL", defaults.sample_interval),
+        flush_interval=_load_positive_float(environ, "TAPO_PUSH_INTERVAL", defaults.flush_interval),
+        buffer_size=_load_positive_int(environ, "TAPO_SAMPLE_BUFFER", defaults.buffer_size),
+    )
+
+
+@dataclass(frozen=True)
+class ShardSettings:
+    """Sharded mode: count worker processes; index, address and authkey are set for workers"""
+    count: int = 1
+    index: Optional[int] = None
+    address: Optional[str] = None
+    authkey: Optional[str] = None
+
+    @property
+    def is_front(self) -> bool:
+        """Whether this process supervises the workers and serves their merged metrics"""
+        return self.count > 1 and self.index is None
+
+
+def load_shard_settings(environ: Mapping[str, str]) -> ShardSettings:
+    """
+    TAPO_SHARDS (number of worker processes, default 1: no sharding); the supervisor passes
+    TAPO_SHARD_INDEX, TAPO_SHARD_ADDRESS and TAPO_SHARD_AUTHKEY to each worker
+    """
+    count = _load_positive_int(environ, "TAPO_SHARDS", 1)
+    index = environ.get("TAPO_SHARD_INDEX", "")
+    if not index:
+        return ShardSettings(count=count)
+    if not index.isdigit() or int(index) >= count:
+        raise ValueError(f"TAPO_SHARD_INDEX must be between 0 and {count - 1}")
+    return ShardSettings(
+        count=count,
+        index=int(index),
+        address=environ.get("TAPO_SHARD_ADDRESS"),
+        authkey=environ.get("TAPO_SHARD_AUTHKEY"),
+    )
+
+
+def shard_configs(configs: List[DeviceConfig], index: int, count: int) -> List[DeviceConfig]:
+    """Devices owned by one shard: a stable hash partition on the device address"""
+    return [c for c in configs if zlib.crc32(c.ip_address.encode("utf-8")) % count == index]
+
+
+@dataclass(frozen=True)
+class StateSettings:
+    """Saved exporter state for warm restarts; disabled while path is None"""
+    path: Optional[str] = None
+    interval: float = 60.0
+
+
+def load_state_settings(environ: Mapping[str, str]) -> StateSettings:
+    """TAPO_STATE_FILE (enables saving and restoring state) and TAPO_STATE_INTERVAL (seconds between saves)"""
+    defaults = StateSettings()
+    return StateSettings(
+        path=environ.get("TAPO_STATE_FILE", "") or None,
+        interval=_load_positive_float(environ, "TAPO_STATE_INTERVAL", defaults.interval),
+    )
+
+
+@dataclass(frozen=True)
+class ControlSettings:
+    """Plug control endpoint; disabled while token is None"""
+    token: Optional[str] = None
+    timeout: float = 15.0
+
+
+def load_control_settings(environ: Mapping[str, str]) -> ControlSettings:
+    """TAPO_CONTROL_TOKEN (bearer token, enables control) and TAPO_CONTROL_TIMEOUT (seconds per command)"""
+    defaults = ControlSettings()
+    return ControlSettings(
+        token=environ.get("TAPO_CONTROL_TOKEN", "") or None,
+        timeout=_load_positive_float(environ, "TAPO_CONTROL_TIMEOUT", defaults.timeout),
+    )
+
+
+@dataclass(frozen=True)
+class ExporterSettings:
+    """Every exporter setting, as this process uses them"""
+    devices: List[DeviceConfig]
+    max_concurrency: int
+    collection: CollectionSettings
+    series_max_age: int
+    schedule: ScheduleSettings
+    push: PushSettings
+    aggregation_window: float
+    sharding: ShardSettings
+    state: StateSettings
+    control: ControlSettings
+    verify_signature: bool
+
+
+def check_device_models(configs: List[DeviceConfig]) -> None:
+    """Raise ValueError if a device's model is not one of SUPPORTED_MODELS"""
+    for config in configs:
+        if config.model not in SUPPORTED_MODELS:
+            raise ValueError(f"Device {config.ip_address}: unsupported model {config.model!r}; "
+                             f"supported: {', '.join(SUPPORTED_MODELS)}")
+
+
+def load_exporter_settings(environ: Mapping[str, str]) -> ExporterSettings:
+    """
+    Load and cross-check every setting. A shard worker gets its share of the devices and its
+    own state file; push mode polls realtime data at the sample interval.
+    Raises ValueError (or OSError reading the device file) on invalid settings.
+    """
+    settings = ExporterSettings(
+        devices=load_device_configs(environ),
+        max_concurrency=load_max_concurrency(environ),
+        collection=load_collection_settings(environ),
+        series_max_age=load_series_max_age(environ),
+        schedule=load_schedule_settings(environ),
+        push=load_push_settings(environ),
+        aggregation_window=load_aggregation_window(environ),
+        sharding=load_shard_settings(environ),
+        state=load_state_settings(environ),
+        control=load_control_settings(environ),
+        verify_signature=load_verify_signature(environ),
+    )
+    check_device_models(settings.devices)
+    if settings.push.url and settings.collection.mode != "poll":
+        raise ValueError("TAPO_PUSH_URL requires TAPO_COLLECTION_MODE=poll")
+    if settings.sharding.count > 1 and settings.collection.mode != "poll":
+        raise ValueError("TAPO_SHARDS requires TAPO_COLLECTION_MODE=poll")
+    if settings.sharding.count > 1 and settings.control.token:
+        raise ValueError("TAPO_CONTROL_TOKEN is not supported with TAPO_SHARDS")
+    sharding = settings.sharding
+    if sharding.index is not None:
+        settings = replace(
+            settings, devices=shard_configs(settings.devices, sharding.index, sharding.count))
+        if settings.state.path:
+            settings = replace(
+                settings, state=replace(settings.state, path=f"{settings.state.path}.{sharding.index}"))
+    if settings.push.url:
+        settings = replace(
+            settings, schedule=replace(settings.schedule, realtime_interval=settings.push.sample_interval))
+    return settings
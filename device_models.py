@@ -0,0 +1,178 @@
+"""# device_models.py"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from tapo_device import AsyncTapoDevice, decode_info_field
+from tapo_p304m import (
+    PLUG_METHODS, PLUG_REALTIME_FIELDS, PLUG_STATE_FIELDS, PlugTable,
+    empty_device_info, join_plugs, nan_usage)
+
+log = logging.getLogger(__name__)
+
+# Method name -> params, as batched into one multipleRequest
+Methods = Dict[str, Optional[Dict[str, Any]]]
+
+
+@dataclass(frozen=True)
+class DeviceModel:
+    """
+    What the exporter polls on one Tapo model. families assigns each method to a metric
+    family, which sets its cadence (realtime: TAPO_POLL_INTERVAL, usage: TAPO_USAGE_INTERVAL,
+    info: TAPO_INFO_INTERVAL); the due families share one multipleRequest. plugs turns the
+    realtime results into plug rows, of which the plug_fields columns are exported.
+    Every model polls the realtime and info families.
+    """
+    name: str
+    families: Dict[str, Methods]
+    plugs: Callable[[Dict[str, Any]], PlugTable]
+    plug_fields: Tuple[str, ...]
+    child_plugs: bool = True  # plugs are child devices, switched through control_child
+
+
+    def methods(self, families: Iterable[str]) -> Methods:
+        """Methods (with params) to request for the given families"""
+        methods: Methods = {}
+        for family in families:
+            methods.update(self.families[family])
+        return methods
+
+
+    def poll_result(
+            self,
+            results: Dict[str, Any],
+            families: Iterable[str],
+            answered: bool = True
+        ) -> Dict[str, Any]:
+        """
+        Build the data of the polled families from batched results, with the usual fallbacks:
+        'plugs' (realtime, a PlugTable), 'device_usage' (usage) and 'device_info' (info).
+        answered is False when the device gave no answer at all (results are then empty).
+        """
+        families = frozenset(families)
+        # Families with a failed method, whose data was replaced by a fallback
+        failed = frozenset(
+            family for family in families
+            if not all(method in results for method in self.families[family]))
+        poll: Dict[str, Any] = {'ok': answered and not failed, 'answered': answered, 'failed': failed}
+        if "realtime" in families:
+            if "realtime" not in failed:
+                poll['plugs'] = self.plugs(results)
+            else:
+                poll['plugs'] = PlugTable()
+        if "usage" in families:
+            poll['device_usage'] = results.get("get_device_usage") or nan_usage()
+        if "info" in families:
+            poll['device_info'] = results.get("get_device_info") or empty_device_info()
+        return poll
+
+
+def child_plugs(results: Dict[str, Any]) -> PlugTable:
+    """Plug rows of a strip without energy monitoring: get_child_device_list only"""
+    table = PlugTable()
+    for plug in results["get_child_device_list"].get("child_device_list", []):
+        table.append(plug, {})
+    return table
+
+
+def single_plug(results: Dict[str, Any]) -> PlugTable:
+    """The one outlet of an energy-monitoring plug: get_device_info plus get_energy_usage"""
+    info = results["get_device_info"]
+    plug = {
+        'position': 1,
+        'device_id': info.get('device_id'),
+        'nickname': decode_info_field(info, 'nickname'),
+        'device_on': info.get('device_on'),
+        'on_time': info.get('on_time'),
+        'overheat_status': 'abnormal' if info.get('overheated') else 'normal',
+    }
+    table = PlugTable()
+    table.append(plug, {'power_mw': results["get_energy_usage"].get('current_power')})
+    return table
+
+
+# Families of the P304M, the base of the other models' families
+P304M_FAMILIES: Dict[str, Methods] = {
+    "realtime": PLUG_METHODS,
+    "usage": {"get_device_usage": None},
+    "info": {"get_device_info": None},
+}
+
+# Registry of supported models, by the model name of get_device_info
+MODELS: Dict[str, DeviceModel] = {}
+
+
+def register_model(model: DeviceModel) -> DeviceModel:
+    """Add a model to the registry (replacing one of the same name)"""
+    MODELS[model.name] = model
+    return model
+
+
+def get_model(name: str) -> DeviceModel:
+    """Registered model by name (case-insensitive); raises ValueError for unknown models"""
+    model = MODELS.get(name.upper())
+    if model is None:
+        raise ValueError(f"Unsupported model {name!r}; supported: {', '.join(sorted(MODELS))}")
+    return model
+
+
+# Power strip with per-plug energy monitoring
+register_model(DeviceModel(
+    name="P304M",
+    families=P304M_FAMILIES,
+    plugs=lambda results: join_plugs(results["get_child_device_list"], results["get_realtime"]),
+    plug_fields=PLUG_STATE_FIELDS + PLUG_REALTIME_FIELDS,
+))
+
+# Power strip without energy monitoring
+register_model(DeviceModel(
+    name="P300",
+    families={**P304M_FAMILIES, "realtime": {"get_child_device_list": None}},
+    plugs=child_plugs,
+    plug_fields=PLUG_STATE_FIELDS,
+))
+
+# Single plugs with energy monitoring; device info is part of realtime for the on/off state
+for _name in ("P110", "P115"):
+    register_model(DeviceModel(
+        name=_name,
+        families={**P304M_FAMILIES, "realtime": {"get_device_info": None, "get_energy_usage": None}},
+        plugs=single_plug,
+        plug_fields=('device_on', 'on_time', 'overheat_status', 'power_mw'),
+        child_plugs=False,
+    ))
+
+
+class AsyncTapoModelDevice:
+    """
+    A Tapo device of any registered model over the asyncio transport; the polling and
+    batching engine shared by every model
+    """
+
+    def __init__(self, model: DeviceModel, ip_address, username, password, **kwargs):
+        """initialize the device with its model, IP address, username, and password"""
+        self.model      = model
+        self.ip_address = ip_address
+        self.tapo_device= AsyncTapoDevice(ip_address, username, password, **kwargs)
+
+
+    async def poll(self, families: Iterable[str]) -> Dict[str, Any]:
+        """Get the data of the given families in a single round-trip; fallbacks if unavailable"""
+        try:
+            results = await self.tapo_device.request_multiple(self.model.methods(families))
+            return self.model.poll_result(results, families)
+        except Exception as ex: # pylint: disable=broad-except
+            log.warning("Failed to poll %s: %s", self.ip_address, ex)
+            return self.model.poll_result({}, families, answered=False)
+
+
+    async def set_plug(self, plug_device_id: str, on: bool) -> None:
+        """Switch one plug (or the device itself, for single plugs) on or off; raises if refused"""
+        if self.model.child_plugs:
+            await self.tapo_device.control_child(plug_device_id, "set_device_info", {"device_on": on})
+        else:
+            await self.tapo_device.set_device_info({"device_on": on})
+
+
+    async def close(self) -> None:
+        """Close the device connection"""
+        await self.tapo_device.close()
@@ -1,9 +1,11 @@
 #!/bin/sh
 set -e
 
-# Check for required env vars
-: "${TAPO_USERNAME:?Environment variable TAPO_USERNAME must be set}"
-: "${TAPO_PASSWORD:?Environment variable TAPO_PASSWORD must be set}"
-: "${TAPO_IP_ADDRESS:?Environment variable TAPO_IP_ADDRESS must be set}"
+# Check for required env vars; a device file may carry its own per-device credentials
+if [ -z "${TAPO_DEVICES_FILE}" ]; then
+    : "${TAPO_USERNAME:?Environment variable TAPO_USERNAME must be set}"
+    : "${TAPO_PASSWORD:?Environment variable TAPO_PASSWORD must be set}"
+    : "${TAPO_IP_ADDRESS:?Environment variable TAPO_IP_ADDRESS or TAPO_DEVICES_FILE must be set}"
+fi
 
 exec python3 prometheus.py
\ No newline at end of file
@@ -0,0 +1,437 @@
+"""# exporter.py"""
+import asyncio
+import concurrent.futures
+import hmac
+import logging
+import time
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+from prometheus_client import CollectorRegistry, Gauge, Enum, generate_latest
+from device_config import ExporterSettings
+from device_models import DeviceModel
+from fleet import Fleet, FleetDevice, PollOutcome
+from tapo_p304m import PlugTable
+from scrape_collector import CoalescingTTLCache, ScrapeCollector
+from series_tracker import SeriesTracker
+from exporter_metrics import ExporterMetrics
+from exposition_cache import ExpositionCache, make_cached_wsgi_app
+from sample_push import SampleBuffer, SamplePusher, sample_key
+from rolling_window import RollingWindow
+from sharding import ShardSender
+from state_store import DeviceMetrics, RestoredCollector, load_state, save_state
+
+log = logging.getLogger(__name__)
+
+DEFAULT_LABELS = ['device_id', 'hw_id', 'fw_ver', 'ip', 'type', 'model']
+PLUG_LABELS = DEFAULT_LABELS + ['plug_position', 'plug_device_id', 'plug_nickname']
+# Realtime fields buffered and pushed in push mode
+SAMPLED_FIELDS = ['power_mw', 'current_ma', 'voltage_mv']
+
+
+class PlugMetricsLayout:
+    """
+    The plug metrics of one device model (those of its plug_fields, plus the window summaries
+    when it reports power), with the series tracker of its plugs
+    """
+
+    def __init__(
+            self,
+            model: DeviceModel,
+            gauges: Dict[str, Gauge],
+            enums: Dict[str, Enum],
+            window_gauges: Dict[str, Gauge],
+            max_age: int,
+            window_capacity: int
+        ):
+        self.gauge_fields   = [field for field in gauges if field in model.plug_fields]
+        self.enum_fields    = [field for field in enums if field in model.plug_fields]
+        self.sampled_fields = [field for field in SAMPLED_FIELDS if field in model.plug_fields]
+        self.windowed       = 'power_mw' in model.plug_fields
+        # Order of the children returned by the tracker
+        metrics = [gauges[field] for field in self.gauge_fields] + [enums[field] for field in self.enum_fields]
+        self.window_start   = len(metrics)
+        if self.windowed:
+            metrics.extend(window_gauges.values())
+        self.series         = SeriesTracker(
+            metrics, max_age,
+            state_factory=(lambda: RollingWindow(window_capacity)) if self.windowed else None)
+        self.metric_names   = [family.name for metric in metrics for family in metric.describe()]
+
+
+class Exporter:
+    """
+    Metrics, device fleet and background tasks of one exporter process. Building it does no
+    device I/O; run() drives the polls (or, in scrape mode, serves refreshes) on its own loop.
+    """
+
+    def __init__(self, settings: ExporterSettings):
+        self.settings = settings
+        if settings.sharding.index is not None:
+            log.info("Shard %d/%d owns %d device(s)", settings.sharding.index,
+                     settings.sharding.count, len(settings.devices))
+        scrape_mode = settings.collection.mode == 'scrape'
+
+        # Create a Prometheus registry
+        self.registry = CollectorRegistry()
+        # Exporter self-metrics; also observes every device protocol
+        self.exporter_metrics = ExporterMetrics(self.registry)
+        # Rendered /metrics output: re-rendered after polls, or in scrape mode once older than the cache TTL.
+        # Workers of the sharded mode send snapshots to the front process instead.
+        if settings.sharding.index is not None:
+            self.exposition = ShardSender(self.registry, settings.sharding, is_ready=self.is_ready)
+        else:
+            self.exposition = ExpositionCache(
+                self.registry, settings.collection.cache_ttl if scrape_mode else None)
+        # Buffered realtime samples, pushed with their poll timestamps (push mode only)
+        push = settings.push
+        self.sample_buffer = SampleBuffer(push.buffer_size) if push.url else None
+        self.pusher = SamplePusher(push.url, push.format, self.sample_buffer, push.flush_interval,
+                                   observer=self.exporter_metrics) if push.url else None
+
+        # Device I/O runs on this loop, driven by run()
+        self.loop = asyncio.new_event_loop()
+        self.fleet = Fleet(settings.devices, settings.max_concurrency, settings.schedule,
+                           observer=self.exporter_metrics, verify_signature=settings.verify_signature)
+
+        # In scrape mode the device metrics live in their own registry, exposed through ScrapeCollector
+        self.device_registry = CollectorRegistry() if scrape_mode else self.registry
+        self._create_metrics()
+
+        if scrape_mode:
+            self.registry.register(ScrapeCollector(
+                self.device_registry,
+                CoalescingTTLCache(self.loop, self.refresh_fleet, settings.collection.cache_ttl),
+                settings.collection.scrape_timeout))
+        self.saved_state = None
+        self.restored = None
+        if settings.state.path:
+            self._restore_state()
+
+
+    def _create_metrics(self) -> None:
+        """Device and plug metrics, and the trackers of their series"""
+        registry = self.device_registry
+        # Device Usage Gauges
+        self.device_gauges = {
+            'power_usage': Gauge(
+                'tapo_p304m_device_usage_power_usage',
+                'Device power usage (in mW)', DEFAULT_LABELS + ['period'], registry=registry),
+            'saved_power': Gauge(
+                'tapo_p304m_device_usage_saved_power',
+                'Device saved power (in mW)', DEFAULT_LABELS + ['period'], registry=registry),
+            'time_usage': Gauge(
+                'tapo_p304m_device_usage_time_usage',
+                'Device time usage (in sec)', DEFAULT_LABELS + ['period'], registry=registry)
+        }
+
+        # Plug Gauges
+        self.plug_gauges = {
+            'current_ma': Gauge(
+                'tapo_p304m_plug_current_ma',
+                'Plug current (in mA)', PLUG_LABELS, registry=registry),
+            'voltage_mv': Gauge(
+                'tapo_p304m_plug_voltage_mv',
+                'Plug voltage (in mV)', PLUG_LABELS, registry=registry),
+            'on_time': Gauge(
+                'tapo_p304m_plug_on_time',
+                'Plug uptime (in sec)', PLUG_LABELS, registry=registry),
+            'power_mw': Gauge(
+                'tapo_p304m_plug_power_mw',
+                'Plug power used (in mW)', PLUG_LABELS, registry=registry),
+            'total_wh': Gauge(
+                'tapo_p304m_plug_total_wh',
+                'Plug energy used (in Wh)', PLUG_LABELS, registry=registry)
+        }
+
+        # Plug Enums
+        self.plug_enums = {
+            'overcurrent_status': Enum(
+                'tapo_p304m_plug_overcurrent_status',
+                'Plug overcurrent status', states=['normal', 'abnormal'],
+                labelnames=PLUG_LABELS, registry=registry),
+            'overheat_status': Enum(
+                'tapo_p304m_plug_overheat_status',
+                'Plug overheat status', states=['normal', 'abnormal'],
+                labelnames=PLUG_LABELS, registry=registry),
+            'charging_status': Enum(
+                'tapo_p304m_plug_charging_status',
+                'Plug charging status', states=['normal', 'abnormal'],
+                labelnames=PLUG_LABELS, registry=registry),
+            'device_on': Enum(
+                'tapo_p304m_plug_device_on',
+                'Plug power status', states=['ON', 'OFF'],
+                labelnames=PLUG_LABELS, registry=registry)
+        }
+
+        # Plug power summaries over the last aggregation window seconds of realtime samples
+        self.plug_window_gauges = {
+            'power_min_mw': Gauge(
+                'tapo_p304m_plug_window_power_min_mw',
+                'Lowest plug power in the aggregation window (in mW)', PLUG_LABELS, registry=registry),
+            'power_max_mw': Gauge(
+                'tapo_p304m_plug_window_power_max_mw',
+                'Highest plug power in the aggregation window (in mW)', PLUG_LABELS, registry=registry),
+            'power_mean_mw': Gauge(
+                'tapo_p304m_plug_window_power_mean_mw',
+                'Time-weighted mean plug power in the aggregation window (in mW)', PLUG_LABELS,
+                registry=registry),
+            'energy_wh': Gauge(
+                'tapo_p304m_plug_window_energy_wh',
+                'Plug energy over the aggregation window, integrated from its realtime samples (in Wh)', PLUG_LABELS,
+                registry=registry)
+        }
+
+        # Series of renamed or vanished plugs (and of changed device labels) are removed after
+        # series_max_age poll cycles without an update
+        max_age = self.settings.series_max_age
+        self.device_series = SeriesTracker(self.device_gauges.values(), max_age)
+        # Each plug also keeps its window of realtime samples; sized for the window plus jitter,
+        # and the sample before it the energy integral starts from
+        window_capacity = int(self.settings.aggregation_window / self.settings.schedule.realtime_interval
+                              * 1.25) + 2
+        # Plug metrics of each model in the fleet
+        self.plug_layouts = {
+            device.model.name: PlugMetricsLayout(
+                device.model, self.plug_gauges, self.plug_enums, self.plug_window_gauges,
+                max_age, window_capacity)
+            for device in self.fleet.devices
+        }
+
+        # Order of the children returned by the device tracker
+        self.device_usage_fields = list(self.device_gauges)
+        self.device_usage_names = [
+            family.name for metric in self.device_gauges.values() for family in metric.describe()]
+
+
+    def _restore_state(self) -> None:
+        """
+        Warm restart: labels and last metrics of the previous run are served (marked by
+        tapo_p304m_exporter_restored_timestamp_seconds) until each device has been polled again.
+        Devices without saved labels get them from their first poll; nothing blocks startup.
+        """
+        saved_state = load_state(self.settings.state.path)
+        if saved_state is None:
+            return
+        # Only devices still configured, with a complete label set
+        addresses = {d.address for d in self.fleet.devices}
+        saved_state.devices = {
+            address: saved for address, saved in saved_state.devices.items()
+            if address in addresses and set(DEFAULT_LABELS) <= set(saved['labels'])
+        }
+        for device in self.fleet.devices:
+            saved_device = saved_state.devices.get(device.address)
+            if saved_device is not None:
+                device.labels = saved_device['labels']
+                device.label_values = tuple(str(device.labels[k]) for k in DEFAULT_LABELS)
+        self.saved_state = saved_state
+        self.restored = RestoredCollector(saved_state)
+        # Registered last, so a device refreshed during a collect is never exported twice
+        self.registry.register(self.restored)
+        log.info("Restored state of %d device(s) from %s", len(saved_state.devices),
+                 self.settings.state.path)
+
+
+    def is_ready(self) -> bool:
+        """
+        Whether the exporter serves current data: in poll mode once every device's first
+        poll finished (successful or not), in scrape mode once the device loop runs
+        """
+        if self.settings.collection.mode == 'scrape':
+            return self.loop.is_running()
+        return all(device.polls for device in self.fleet.devices)
+
+
+    # --- Metrics Updater Tasks ---
+
+    def apply_device_info(self, device: FleetDevice, device_info: Dict[str, Any]) -> bool:
+        """Derive the device labels from device info; False (labels kept) if the info is unavailable"""
+        if device_info.get('device_id', 'unknown') == 'unknown':
+            # 'unknown' labels would collide between strips, so keep the last known labels
+            log.warning("Device info unavailable for %s, will retry", device.address)
+            return False
+        labels = {k: device_info[k] for k in DEFAULT_LABELS}
+        if labels != device.labels:
+            device.labels = labels
+            device.label_values = tuple(str(labels[k]) for k in DEFAULT_LABELS)
+            log.info("Device info retrieved for %s: %s", device.address, device.labels)
+        return True
+
+
+    def update_device_usage_metrics(self, device: FleetDevice, device_usage: Dict[str, Any]):
+        """Update device usage metrics for one device."""
+        for index, metric in enumerate(self.device_usage_fields):
+            values = device_usage.get(metric, {})
+            for period, value in values.items():
+                children = self.device_series.children(device.address, device.label_values + (str(period),))
+                children[index].set(value)
+        log.debug("Device usage metrics updated for %s", device.address)
+
+
+    def update_plug_metrics(self, device: FleetDevice, plugs: PlugTable):
+        """Update the plug metrics of the device's model, in one pass over the plug table columns."""
+        timestamp_ms = int(time.time() * 1000)
+        now = time.monotonic()
+        window_length = self.settings.aggregation_window
+        layout = self.plug_layouts[device.model.name]
+        gauge_columns = [getattr(plugs, field) for field in layout.gauge_fields]
+        enum_columns = [getattr(plugs, field) for field in layout.enum_fields]
+        sampled_columns = [getattr(plugs, field) for field in layout.sampled_fields]
+        identities = zip(plugs.position, plugs.device_id, plugs.nickname)
+        for i, (position, plug_id, nickname) in enumerate(identities):
+            labelvalues = device.label_values + (str(position), str(plug_id), str(nickname))
+            children = layout.series.children(device.address, labelvalues)
+            # Gauges
+            for column, child in zip(gauge_columns, children):
+                child.set(column[i])
+            # Enums
+            for column, child in zip(enum_columns, children[len(layout.gauge_fields):]):
+                child.state(column[i])
+            if layout.windowed:
+                # Window summaries over the plug's sample window
+                window = layout.series.state(device.address, labelvalues)
+                window.append(now, plugs.power_mw[i])
+                power_min, power_max, power_mean, mw_seconds = window.stats(now, window_length)
+                min_child, max_child, mean_child, energy_child = children[layout.window_start:]
+                min_child.set(power_min)
+                max_child.set(power_max)
+                mean_child.set(power_mean)
+                energy_child.set(mw_seconds / 1000 / 3600)
+            if self.sample_buffer is not None:
+                for field, column in zip(layout.sampled_fields, sampled_columns):
+                    self.sample_buffer.append(
+                        sample_key(f'tapo_p304m_plug_sampled_{field}', PLUG_LABELS, labelvalues),
+                        timestamp_ms, column[i])
+        log.debug("Plug metrics updated for %d plugs of %s.", len(plugs), device.address)
+
+
+    async def poll_device(self, device: FleetDevice, families: FrozenSet[str]) -> PollOutcome:
+        """Poll the due metric families of one device in a single batched round-trip."""
+        if device.labels is None:
+            # Labels are needed before any series can be exported
+            families = families | {'info'}
+        poll = await device.tapo.poll(families)
+        failed = poll['failed']
+        if 'info' in families and not self.apply_device_info(device, poll['device_info']):
+            failed = failed | {'info'}
+        outcome = PollOutcome(poll['answered'], failed)
+        self.exporter_metrics.poll(device.address, outcome.ok)
+        if device.labels is None:
+            self.exposition.invalidate()
+            # Nothing could be exported: retry every family soon
+            return PollOutcome(poll['answered'], families)
+        # A device still served from the saved state keeps its restored values instead of
+        # fallbacks. A family it polled successfully replaces the restored series of its
+        # metrics, which are dropped before the live ones exist, so no scrape sees both.
+        restoring = self.restored is not None and self.restored.is_pending(device.address)
+        updated = families - failed if restoring else families
+        if 'usage' in updated:
+            if restoring:
+                self.restored.metrics_refreshed(device.address, self.device_usage_names)
+            self.device_series.start_cycle(device.address)
+            self.update_device_usage_metrics(device, poll['device_usage'])
+            self.device_series.sweep(device.address)
+        if 'realtime' in updated:
+            layout = self.plug_layouts[device.model.name]
+            if restoring:
+                self.restored.metrics_refreshed(device.address, layout.metric_names)
+            layout.series.start_cycle(device.address)
+            self.update_plug_metrics(device, poll['plugs'])
+            if 'realtime' not in failed:
+                device.plugs = poll['plugs']
+            layout.series.sweep(device.address)
+        if restoring and outcome.ok and 'realtime' in families:
+            self.restored.device_refreshed(device.address)
+        self.exposition.invalidate()
+        return outcome
+
+
+    async def refresh_fleet(self):
+        """Poll the realtime family (plus whatever else is due) of every device; used by the scrape collector."""
+        await self.fleet.run_each(self.poll_device)
+
+
+    async def save_state_forever(self):
+        """Save device labels and the last device metrics every state interval"""
+        path = self.settings.state.path
+        while True:
+            await asyncio.sleep(self.settings.state.interval)
+            devices = {d.address: {'labels': d.labels} for d in self.fleet.devices if d.labels is not None}
+            if self.saved_state is not None:
+                # Keep what is known about devices that have not answered since the restart
+                devices = {**self.saved_state.devices, **devices}
+            try:
+                # In scrape mode the restored series are not on the device registry: save them
+                # too, so the devices still pending keep their series along with their labels
+                scrape_restored = self.restored is not None and self.device_registry is not self.registry
+                extra = [self.restored] if scrape_restored else []
+                metrics = generate_latest(DeviceMetrics(self.device_registry, *extra))
+                await self.loop.run_in_executor(None, save_state, path, time.time(), devices, metrics)
+            except Exception as e: # pylint: disable=broad-except
+                log.error("Failed to save state to %s: %s", path, e)
+
+
+    # --- HTTP ---
+
+    def metrics_app(self):
+        """WSGI app serving the rendered /metrics output"""
+        return make_cached_wsgi_app(self.exposition)
+
+
+    def control_plug(
+            self,
+            device_id: str,
+            position: int,
+            authorization: str,
+            body: Optional[Any]
+        ) -> Tuple[int, Dict[str, Any]]:
+        """
+        Switch one plug, for POST {"on": true|false} with Authorization: Bearer <TAPO_CONTROL_TOKEN>.
+        Takes the Authorization header and the parsed JSON body; returns (HTTP status, JSON response).
+        """
+        control = self.settings.control
+        # Compared as bytes: compare_digest refuses non-ASCII strings
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {control.token}".encode()):
+            return 403, {'error': "invalid token"}
+        if not isinstance(body, dict) or not isinstance(body.get('on'), bool):
+            return 400, {'error': 'body must be {"on": true|false}'}
+        device = next((d for d in self.fleet.devices if d.labels and d.labels['device_id'] == device_id), None)
+        if device is None:
+            return 404, {'error': f"unknown device {device_id}"}
+        # Plugs are addressed by position; their device_id comes from the last poll
+        plugs = device.plugs
+        if plugs is None or position not in plugs.position:
+            return 404, {'error': f"unknown plug {position} of device {device_id}"}
+        plug_device_id = plugs.device_id[plugs.position.index(position)]
+        future = asyncio.run_coroutine_threadsafe(device.control_plug(plug_device_id, body['on']), self.loop)
+        try:
+            state = future.result(control.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return 504, {'error': "device did not answer in time"}
+        except Exception as e: # pylint: disable=broad-except
+            # Refused by the device (AuthProtocolError) or transport failure
+            log.warning("Switching plug %d of %s failed: %s", position, device.address, e)
+            return 502, {'error': str(e)}
+        log.info("Switched plug %d of %s %s", position, device.address, "on" if state else "off")
+        # A later request for the same plug may have replaced this one before it was sent
+        return 200, {
+            'device_id': device_id, 'plug_position': position, 'plug_device_id': plug_device_id, 'on': state,
+        }
+
+
+    def run(self) -> None:
+        """Start the background tasks and run the device loop (blocks)"""
+        asyncio.set_event_loop(self.loop)
+        settings = self.settings
+        if settings.collection.mode == 'poll':
+            self.loop.create_task(self.fleet.run_forever(self.poll_device))
+            self.exposition.start()
+            if self.pusher is not None:
+                self.loop.create_task(self.pusher.run_forever())
+                log.info("Pushing %.1fs samples to %s every %.1fs",
+                         settings.push.sample_interval, settings.push.url, settings.push.flush_interval)
+            log.info("Background metric updater tasks started")
+        else:
+            log.info("Scrape-driven collection enabled (cache TTL %.1fs)", settings.collection.cache_ttl)
+        if settings.state.path:
+            self.loop.create_task(self.save_state_forever())
+        self.loop.run_forever()
@@ -0,0 +1,85 @@
+"""# exporter_metrics.py"""
+import time
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from auth_protocol import ProtocolObserver
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05)
+PAYLOAD_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+class ExporterMetrics(ProtocolObserver):
+    """Self-metrics of the exporter: device round-trips, handshakes, errors and poll outcomes"""
+
+    def __init__(self, registry: CollectorRegistry):
+        self.request_duration = Histogram(
+            'tapo_p304m_exporter_request_duration_seconds',
+            'Device HTTP round-trip time by method; batches by their methods joined with + (in sec)', ['method'],
+            buckets=REQUEST_BUCKETS, registry=registry)
+        self.stage_duration = Histogram(
+            'tapo_p304m_exporter_request_stage_duration_seconds',
+            'Local request work: encode (JSON, encrypt, sign) and decode (verify, decrypt, JSON) (in sec)',
+            ['stage'], buckets=STAGE_BUCKETS, registry=registry)
+        self.payload_bytes = Histogram(
+            'tapo_p304m_exporter_payload_bytes',
+            'Device request and response body sizes (in bytes)', ['direction'],
+            buckets=PAYLOAD_BUCKETS, registry=registry)
+        self.handshakes = Counter(
+            'tapo_p304m_exporter_handshakes',
+            'Device handshakes by result', ['address', 'result'], registry=registry)
+        self.handshake_duration = Histogram(
+            'tapo_p304m_exporter_handshake_duration_seconds',
+            'Device handshake time (in sec)', buckets=REQUEST_BUCKETS, registry=registry)
+        self.device_errors = Counter(
+            'tapo_p304m_exporter_device_errors',
+            'Device error codes, rejected responses and transport errors', ['address', 'error_code'], registry=registry)
+        self.polls = Counter(
+            'tapo_p304m_exporter_polls',
+            'Device polls by result', ['address', 'result'], registry=registry)
+        self.last_success = Gauge(
+            'tapo_p304m_exporter_last_success_timestamp_seconds',
+            'Time of the last successful poll of the device (unix time)', ['address'],
+            registry=registry)
+        self.pushed_samples = Counter(
+            'tapo_p304m_exporter_pushed_samples',
+            'High-frequency samples pushed, by result', ['result'], registry=registry)
+        self.dropped_samples = Counter(
+            'tapo_p304m_exporter_dropped_samples',
+            'High-frequency samples dropped from full buffers before they could be pushed',
+            registry=registry)
+
+
+    def round_trip(self, address: str, method: str, seconds: float, sent: int, received: int) -> None:
+        self.request_duration.labels(method).observe(seconds)
+        self.payload_bytes.labels('request').observe(sent)
+        self.payload_bytes.labels('response').observe(received)
+
+
+    def stage(self, address: str, stage: str, seconds: float) -> None:
+        self.stage_duration.labels(stage).observe(seconds)
+
+
+    def handshake(self, address: str, seconds: float, ok: bool) -> None:
+        self.handshakes.labels(address, 'success' if ok else 'failure').inc()
+        self.handshake_duration.observe(seconds)
+
+
+    def device_error(self, address: str, error_code: str) -> None:
+        self.device_errors.labels(address, error_code).inc()
+
+
+    def poll(self, address: str, ok: bool) -> None:
+        """Record the outcome of one device poll"""
+        self.polls.labels(address, 'success' if ok else 'failure').inc()
+        if ok:
+            self.last_success.labels(address).set(time.time())
+
+
+    def push(self, samples: int, ok: bool) -> None:
+        """Record the outcome of one sample push"""
+        self.pushed_samples.labels('success' if ok else 'failure').inc(samples)
+
+
+    def samples_dropped(self, samples: int) -> None:
+        """Record samples lost to a full buffer"""
+        self.dropped_samples.inc(samples)
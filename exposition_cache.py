@@ -0,0 +1,143 @@
+"""# exposition_cache.py"""
+import gzip
+import logging
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from prometheus_client import CollectorRegistry, make_wsgi_app
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+
+log = logging.getLogger(__name__)
+
+GZIP_LEVEL = 6
+
+
+class Rendering:
+    """One rendered exposition format: plain and gzipped bytes, and an ETag of the content"""
+
+    __slots__ = ("content_type", "body", "gzipped", "etag")
+
+    def __init__(self, content_type: str, body: bytes):
+        self.content_type   = content_type
+        self.body           = body
+        self.gzipped        = gzip.compress(body, GZIP_LEVEL)
+        self.etag           = f'"{zlib.crc32(body):08x}-{len(body)}"'
+
+
+class ExpositionCache:
+    """
+    /metrics output rendered once per generation and served from memory.
+    Pollers call invalidate() after updating metrics; the exposition is then re-rendered by
+    a background thread (poll mode, start() called) or by the next scrape older than max_age
+    (scrape mode, where rendering is what triggers the device refresh).
+    """
+
+    def __init__(
+            self,
+            registry: CollectorRegistry,
+            max_age: Optional[float] = None,
+            debounce: float = 1.0
+        ):
+        self.registry                                   = registry
+        self.max_age                                    = max_age
+        self.debounce                                   = debounce
+        self.generation                                 = 0
+        self._rendered_generation                       = -1
+        self._rendered_at                               = 0.0
+        # Plain text is always rendered; OpenMetrics only once a scraper has asked for it
+        self._accepts: Dict[str, str]                   = {"text": ""}
+        self._renderings: Dict[str, Rendering]          = {}
+        self._lock                                      = threading.Lock()
+        self._stale                                     = threading.Event()
+
+
+    def invalidate(self) -> None:
+        """Mark the exposition stale (thread-safe; called from the poller loop)"""
+        self.generation += 1
+        self._stale.set()
+
+
+    def _render(self) -> None:
+        """Render every wanted format of the current generation (caller holds the lock)"""
+        generation = self.generation
+        renderings = {}
+        for key, accept in self._accepts.items():
+            encoder, content_type = choose_encoder(accept)
+            renderings[key] = Rendering(content_type, encoder(self.registry))
+        self._renderings = renderings
+        self._rendered_generation = generation
+        self._rendered_at = time.monotonic()
+
+
+    def _is_stale(self, key: str) -> bool:
+        """Whether a format must be rendered before it can be served"""
+        if key not in self._renderings:
+            return True
+        return self.max_age is not None and time.monotonic() - self._rendered_at >= self.max_age
+
+
+    def get(self, accept: str) -> Rendering:
+        """Rendering of the format chosen by the Accept header"""
+        _, content_type = choose_encoder(accept)
+        key = "openmetrics" if content_type.startswith("application/openmetrics-text") else "text"
+        rendering = self._renderings.get(key)
+        if rendering is not None and not self._is_stale(key):
+            return rendering
+        with self._lock:
+            # Concurrent scrapes wait for one render instead of rendering in parallel
+            if self._is_stale(key):
+                self._accepts.setdefault(key, accept)
+                self._render()
+            return self._renderings[key]
+
+
+    def _run(self) -> None:
+        """Background renderer: re-render shortly after each invalidation"""
+        while True:
+            self._stale.wait()
+            # Let the polls finishing around the same time land in one render
+            time.sleep(self.debounce)
+            self._stale.clear()
+            if self.generation == self._rendered_generation:
+                continue
+            try:
+                with self._lock:
+                    self._render()
+            except Exception as e: # pylint: disable=broad-except
+                log.error("Failed to render metrics: %s", e, exc_info=True)
+
+
+    def start(self) -> None:
+        """Start the background renderer"""
+        threading.Thread(target=self._run, name="exposition-renderer", daemon=True).start()
+
+
+def make_cached_wsgi_app(cache: ExpositionCache) -> Callable:
+    """
+    WSGI app serving the cached exposition, gzipped when accepted, with ETag / If-None-Match.
+    Requests filtering with name[] fall back to a live render.
+    """
+    live_app = make_wsgi_app(cache.registry)
+
+    def app(environ: Dict, start_response: Callable) -> Iterable[bytes]:
+        if environ.get('QUERY_STRING'):
+            return live_app(environ, start_response)
+        rendering = cache.get(environ.get('HTTP_ACCEPT', ''))
+        headers: List[Tuple[str, str]] = [
+            ('Content-Type', rendering.content_type),
+            ('ETag', rendering.etag),
+            ('Vary', 'Accept, Accept-Encoding'),
+        ]
+        if environ.get('HTTP_IF_NONE_MATCH') == rendering.etag:
+            start_response('304 Not Modified', headers)
+            return [b'']
+        body = rendering.body
+        if gzip_accepted(environ.get('HTTP_ACCEPT_ENCODING', '')):
+            body = rendering.gzipped
+            headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length', str(len(body))))
+        start_response('200 OK', headers)
+        return [body]
+
+    return app
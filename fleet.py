@@ -0,0 +1,182 @@
+"""# fleet.py"""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, FrozenSet, List, Optional, Tuple
+from auth_protocol import ProtocolObserver
+from command_queue import CommandQueue
+from device_config import DeviceConfig, ScheduleSettings
+from device_models import AsyncTapoModelDevice, get_model
+from scheduler import DeviceSchedule
+from tapo_p304m import PlugTable
+
+log = logging.getLogger(__name__)
+
+
+class FleetDevice:
+    """
+    One device of the fleet, of any registered model: its own device session plus its
+    resolved Prometheus labels.
+    Write commands go through a per-device queue; the session's request lock keeps them
+    in sequence with the polls.
+    """
+
+    def __init__(self, config: DeviceConfig, settings: ScheduleSettings, **kwargs):
+        self.config                             = config
+        self.model                              = get_model(config.model)
+        self.tapo                               = AsyncTapoModelDevice(
+            self.model, config.ip_address, config.username, config.password, **kwargs)
+        # Only the families the model polls get scheduled
+        intervals = {f: i for f, i in settings.intervals.items() if f in self.model.families}
+        self.schedule                           = DeviceSchedule(
+            intervals, settings.realtime_interval, settings.backoff_max)
+        self.labels: Optional[Dict[str, str]]   = None
+        self.label_values: Tuple[str, ...]      = ()  # labels in DEFAULT_LABELS order
+        self.plugs: Optional[PlugTable]         = None  # plugs of the last successful poll
+        self.polls                              = 0  # finished poll attempts
+        self.commands                           = CommandQueue(self._set_plug)
+        self.wakeup                             = asyncio.Event()  # set to poll before next_due
+
+
+    @property
+    def address(self) -> str:
+        """Device address, used in logs"""
+        return self.config.ip_address
+
+
+    async def _set_plug(self, plug_device_id: str, on: bool) -> bool:
+        """Execute a queued plug command; returns the state that was set"""
+        await self.tapo.set_plug(plug_device_id, on)
+        return on
+
+
+    async def control_plug(self, plug_device_id: str, on: bool) -> bool:
+        """
+        Switch a plug through the command queue, then have the realtime family polled
+        right away so the metrics show the new state. Returns the state that was set,
+        which differs from on if a later command for the plug replaced this one.
+        """
+        try:
+            return await self.commands.submit(plug_device_id, on)
+        finally:
+            self.schedule.expedite("realtime", time.monotonic())
+            self.wakeup.set()
+
+
+@dataclass(frozen=True)
+class PollOutcome:
+    """How a device poll went, which sets when its families are polled next"""
+    answered: bool  # False: no answer at all (transport, session or deadline failure)
+    failed: FrozenSet[str] = frozenset()  # polled families whose data could not be fetched
+
+
+    @property
+    def ok(self) -> bool:
+        """True when every polled family was fetched"""
+        return self.answered and not self.failed
+
+
+# Outcome of a poll that failed or exceeded its deadline
+NO_ANSWER = PollOutcome(answered=False)
+
+# Polls the given metric families of a device
+FleetJob = Callable[[FleetDevice, FrozenSet[str]], Awaitable[PollOutcome]]
+
+
+class Fleet:
+    """
+    Polls every strip concurrently, with at most max_concurrency strips in flight.
+    Each strip runs on its own schedule (per-family intervals, jitter, failure backoff),
+    and each poll is cut off after the poll deadline so slow strips can't starve the rest.
+    """
+
+    def __init__(
+            self,
+            configs: List[DeviceConfig],
+            max_concurrency: int,
+            settings: ScheduleSettings,
+            observer: Optional[ProtocolObserver] = None,
+            **device_kwargs
+        ):
+        """observer instruments the protocols and polls; device_kwargs go to each device's protocol"""
+        self.settings   = settings
+        self.observer   = observer or ProtocolObserver()
+        self.devices    = [
+            FleetDevice(config, settings, timeout=settings.request_timeout,
+                        metadata_ttl=settings.info_interval, observer=self.observer, **device_kwargs)
+            for config in configs
+        ]
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+
+    async def _run_one(self, job: FleetJob, device: FleetDevice, families: FrozenSet[str]) -> PollOutcome:
+        """Run a job for one device within the poll deadline; NO_ANSWER if it failed or timed out"""
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(job(device, families), self.settings.poll_deadline)
+            except asyncio.TimeoutError:
+                log.warning("Poll of %s exceeded its %.1fs deadline", device.address,
+                            self.settings.poll_deadline)
+            except Exception as e: # pylint: disable=broad-except
+                log.error("Poll of %s failed: %s", device.address, e, exc_info=True)
+        # The job was cut off before it could record the poll
+        self.observer.poll(device.address, False)
+        return NO_ANSWER
+
+
+    async def _poll(self, job: FleetJob, device: FleetDevice, families: FrozenSet[str]) -> None:
+        """Poll the families of one device and reschedule them"""
+        outcome = await self._run_one(job, device, families)
+        device.schedule.done(families, time.monotonic(), outcome.answered, outcome.failed)
+        device.polls += 1
+
+
+    async def run_each(self, job: FleetJob, families: Optional[FrozenSet[str]] = None) -> None:
+        """
+        Run a job once for every device, for the given families or else for the realtime
+        family plus whatever is due; devices backing off after failures are skipped
+        """
+        now = time.monotonic()
+        polls = []
+        for device in self.devices:
+            due = families
+            if due is None:
+                due = device.schedule.due(now)
+                if device.schedule.failures == 0:
+                    due = due | {"realtime"}
+            if due:
+                polls.append(self._poll(job, device, due))
+        await asyncio.gather(*polls)
+
+
+    async def _device_loop(self, job: FleetJob, device: FleetDevice) -> None:
+        """Poll one device whenever one of its families is due"""
+        # Spread the first polls over one interval so devices don't poll in lockstep
+        await self._wait(device, random.uniform(0, self.settings.realtime_interval))
+        while True:
+            families = device.schedule.due(time.monotonic())
+            if families:
+                await self._poll(job, device, families)
+            await self._wait(device, device.schedule.next_due() - time.monotonic())
+
+
+    @staticmethod
+    async def _wait(device: FleetDevice, delay: float) -> None:
+        """Sleep for delay seconds, or until the device is woken up (e.g. after a command)"""
+        device.wakeup.clear()
+        try:
+            await asyncio.wait_for(device.wakeup.wait(), max(0.0, delay))
+        except asyncio.TimeoutError:
+            pass
+
+
+    async def run_forever(self, job: FleetJob) -> None:
+        """Poll every device on its own schedule"""
+        await asyncio.gather(*(self._device_loop(job, device) for device in self.devices))
+
+
+    async def close(self) -> None:
+        """Close every device connection"""
+        await asyncio.gather(*(device.tapo.close() for device in self.devices))
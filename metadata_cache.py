@@ -0,0 +1,52 @@
+"""# metadata_cache.py"""
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+
+class MetadataCache:
+    """
+    Results of static device methods (device info, child components) with a TTL.
+    Every fetch of such a method, alone or batched, goes through put(), which reports
+    whether the value changed so callers can react to firmware upgrades or IP changes.
+    change_keys limits that comparison to some keys of a method's result, so volatile
+    fields (e.g. on_time or rssi of get_device_info) don't count as changes.
+    """
+
+    def __init__(self, ttl: float, change_keys: Optional[Mapping[str, Tuple[str, ...]]] = None):
+        self.ttl                                            = ttl
+        self.change_keys                                    = change_keys or {}
+        self._entries: Dict[str, Tuple[float, Any]]         = {}
+
+
+    def get(self, method: str, now: Optional[float] = None) -> Optional[Any]:
+        """Cached result of the method, or None if missing or older than the TTL"""
+        entry = self._entries.get(method)
+        if entry is None:
+            return None
+        fetched_at, value = entry
+        if (time.monotonic() if now is None else now) - fetched_at >= self.ttl:
+            return None
+        return value
+
+
+    def put(self, method: str, value: Any, now: Optional[float] = None) -> bool:
+        """Store a fresh result; True if it differs from the previous one (False the first time)"""
+        previous = self._entries.get(method)
+        self._entries[method] = (time.monotonic() if now is None else now, value)
+        return previous is not None and self._identity(method, previous[1]) != self._identity(method, value)
+
+
+    def _identity(self, method: str, value: Any) -> Any:
+        """The part of a result compared for changes: its change_keys, or all of it"""
+        keys = self.change_keys.get(method)
+        if keys is None or not isinstance(value, dict):
+            return value
+        return tuple(value.get(key) for key in keys)
+
+
+    def invalidate(self, method: Optional[str] = None) -> None:
+        """Forget one method, or everything"""
+        if method is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(method, None)
@@ -0,0 +1,74 @@
+"""# rolling_window.py"""
+import math
+from array import array
+from typing import Tuple
+
+
+class RollingWindow:
+    """
+    Fixed-capacity ring of (monotonic time, value) samples in two float arrays, with
+    time-weighted statistics over the most recent window seconds
+    """
+
+    __slots__ = ("capacity", "_times", "_values", "_head", "_count")
+
+    def __init__(self, capacity: int):
+        self.capacity   = capacity
+        self._times     = array("d", bytes(8 * capacity))
+        self._values    = array("d", bytes(8 * capacity))
+        self._head      = 0  # index the next sample is written to
+        self._count     = 0
+
+
+    def append(self, timestamp: float, value: float) -> None:
+        """Add a sample, overwriting the oldest one when full"""
+        self._times[self._head] = timestamp
+        self._values[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+
+    def stats(self, now: float, window: float) -> Tuple[float, float, float, float]:
+        """
+        (min, max, time-weighted mean, integral) of the samples of the last window seconds.
+        The integral (trapezoidal, value x seconds) spans the whole window: from its start,
+        interpolated from the last sample before it (or from the oldest sample, if none is
+        that old), up to now, holding the newest value. All NaN when the window holds no sample
+        """
+        start = now - window
+        index = self._head
+        samples = 0
+        low = high = integral = 0.0
+        newest = newest_value = previous_time = previous_value = 0.0
+        covered_from = start
+        # Walk from the newest sample back to the window start
+        for _ in range(self._count):
+            index = (index - 1) % self.capacity
+            timestamp = self._times[index]
+            value = self._values[index]
+            if timestamp < start:
+                if samples:
+                    # Segment crossing the window start, cut at the interpolated start value
+                    slope = (previous_value - value) / (previous_time - timestamp)
+                    start_value = value + slope * (start - timestamp)
+                    integral += (previous_time - start) * (previous_value + start_value) / 2
+                break
+            if samples == 0:
+                low = high = value
+                newest, newest_value = timestamp, value
+            else:
+                low = min(low, value)
+                high = max(high, value)
+                integral += (previous_time - timestamp) * (previous_value + value) / 2
+            previous_time, previous_value = timestamp, value
+            samples += 1
+        else:
+            # No sample before the window: it is covered from the oldest sample only
+            covered_from = previous_time
+        if samples == 0:
+            return math.nan, math.nan, math.nan, math.nan
+        if now > newest:
+            integral += (now - newest) * newest_value
+        span = now - covered_from
+        mean = integral / span if span > 0 else newest_value
+        return low, high, mean, integral
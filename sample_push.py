@@ -0,0 +1,204 @@
+"""# sample_push.py"""
+import asyncio
+import logging
+import struct
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+import aiohttp
+
+try:
+    import snappy # python-snappy, optional
+except ImportError:
+    snappy = None
+
+log = logging.getLogger(__name__)
+
+# Metric name plus sorted (label, value) pairs
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+# (timestamp in ms, value)
+Sample = Tuple[int, float]
+
+_DOUBLE = struct.Struct("<d")
+_SNAPPY_CHUNK = 65536
+
+
+def _varint(value: int) -> bytes:
+    """Protobuf base-128 varint of a non-negative integer"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(number: int, payload: bytes) -> bytes:
+    """Length-delimited protobuf field"""
+    return _varint(number << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series: Dict[SeriesKey, List[Sample]]) -> bytes:
+    """Prometheus remote-write WriteRequest protobuf (timeseries of labels and samples)"""
+    out = bytearray()
+    for (name, labels), samples in series.items():
+        timeseries = bytearray()
+        # Labels must be sorted by name; __name__ sorts first
+        for label, value in (("__name__", name),) + labels:
+            timeseries += _field(1, _field(1, label.encode()) + _field(2, value.encode()))
+        for timestamp, value in samples:
+            # Sample: double value (field 1, fixed64), int64 timestamp (field 2, varint)
+            timeseries += _field(2, b"\x09" + _DOUBLE.pack(value) + b"\x10" + _varint(timestamp))
+        out += _field(1, bytes(timeseries))
+    return bytes(out)
+
+
+def snappy_compress(data: bytes) -> bytes:
+    """Snappy block format; without python-snappy, a valid literal-only (uncompressed) block"""
+    if snappy is not None:
+        return snappy.compress(data)
+    out = bytearray(_varint(len(data)))
+    for start in range(0, len(data), _SNAPPY_CHUNK):
+        chunk = data[start:start + _SNAPPY_CHUNK]
+        # Literal tag 61: length - 1 follows in two little-endian bytes
+        out += bytes((61 << 2,)) + (len(chunk) - 1).to_bytes(2, "little") + chunk
+    return bytes(out)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the text exposition format"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def encode_text(series: Dict[SeriesKey, List[Sample]]) -> bytes:
+    """Prometheus text exposition lines with sample timestamps (ms)"""
+    lines = []
+    for (name, labels), samples in series.items():
+        selector = name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+        lines.extend(f"{selector} {value!r} {timestamp}" for timestamp, value in samples)
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class SampleBuffer:
+    """
+    Bounded ring buffer of samples per series. Samples stay buffered until a flush
+    acknowledges them, so a failed push is retried; when a buffer is full the oldest
+    samples are dropped.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity                                                   = capacity
+        self.dropped                                                    = 0
+        self._seq                                                       = 0
+        self._acked                                                     = 0
+        self._series: Dict[SeriesKey, Deque[Tuple[int, int, float]]]    = {}
+
+
+    def append(self, key: SeriesKey, timestamp_ms: int, value: float) -> None:
+        """Buffer one sample of a series"""
+        samples = self._series.get(key)
+        if samples is None:
+            samples = self._series[key] = deque(maxlen=self.capacity)
+        if len(samples) == self.capacity and samples[0][0] > self._acked:
+            self.dropped += 1
+        self._seq += 1
+        samples.append((self._seq, timestamp_ms, value))
+
+
+    def pending(self) -> Tuple[Dict[SeriesKey, List[Sample]], int]:
+        """Unacknowledged samples per series, and the mark to ack() once they are delivered"""
+        series = {}
+        for key, samples in self._series.items():
+            batch = [(timestamp, value) for seq, timestamp, value in samples if seq > self._acked]
+            if batch:
+                series[key] = batch
+        return series, self._seq
+
+
+    def ack(self, mark: int) -> None:
+        """Forget the samples returned by pending() up to the mark"""
+        self._acked = max(self._acked, mark)
+        for key in list(self._series):
+            samples = self._series[key]
+            while samples and samples[0][0] <= self._acked:
+                samples.popleft()
+            if not samples:
+                del self._series[key]
+
+
+class SamplePusher:
+    """Flushes a SampleBuffer to a remote-write endpoint or a text-format push endpoint"""
+
+    def __init__(
+            self,
+            url: str,
+            push_format: str,
+            buffer: SampleBuffer,
+            interval: float,
+            timeout: float = 10.0,
+            observer=None
+        ):
+        self.url                                        = url
+        self.push_format                                = push_format
+        self.buffer                                     = buffer
+        self.interval                                   = interval
+        self.timeout                                    = timeout
+        self.observer                                   = observer
+        self._session: Optional[aiohttp.ClientSession]  = None
+        self._dropped                                   = 0
+
+
+    def _encode(self, series: Dict[SeriesKey, List[Sample]]) -> Tuple[bytes, Dict[str, str]]:
+        """Request body and headers of one push"""
+        if self.push_format == "remote_write":
+            return snappy_compress(encode_write_request(series)), {
+                "Content-Type": "application/x-protobuf",
+                "Content-Encoding": "snappy",
+                "X-Prometheus-Remote-Write-Version": "0.1.0",
+            }
+        return encode_text(series), {"Content-Type": "text/plain; version=0.0.4"}
+
+
+    async def flush(self) -> bool:
+        """Push every pending sample; they stay buffered if the push fails"""
+        series, mark = self.buffer.pending()
+        count = sum(len(samples) for samples in series.values())
+        if self.observer is not None and self.buffer.dropped > self._dropped:
+            self.observer.samples_dropped(self.buffer.dropped - self._dropped)
+            self._dropped = self.buffer.dropped
+        if not count:
+            return True
+        body, headers = self._encode(series)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        ok = False
+        try:
+            async with self._session.post(self.url, data=body, headers=headers) as resp:
+                ok = resp.status < 300
+                if not ok:
+                    log.warning("Push to %s rejected: HTTP %d %s", self.url, resp.status,
+                                (await resp.text())[:200])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Push to %s failed: %s", self.url, e)
+        if ok:
+            self.buffer.ack(mark)
+        if self.observer is not None:
+            self.observer.push(count, ok)
+        return ok
+
+
+    async def run_forever(self) -> None:
+        """Flush every interval"""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+
+    async def close(self) -> None:
+        """Close the HTTP session"""
+        if self._session is not None:
+            await self._session.close()
+
+
+def sample_key(name: str, labelnames: Sequence[str], labelvalues: Sequence[str]) -> SeriesKey:
+    """Series key with labels sorted by name, as remote-write requires"""
+    return name, tuple(sorted(zip(labelnames, labelvalues)))
@@ -0,0 +1,83 @@
+"""# scheduler.py"""
+import random
+from typing import AbstractSet, Dict, FrozenSet, Iterable
+
+
+class DeviceSchedule:
+    """
+    When each metric family of one device is next due. Families are rescheduled with a
+    little jitter so devices drift apart instead of polling in lockstep; polls the device
+    did not answer back off exponentially (with jitter) so an unreachable device is retried
+    ever less often
+    """
+
+    def __init__(
+            self,
+            intervals: Dict[str, float],
+            backoff_base: float,
+            backoff_max: float,
+            jitter: float = 0.1
+        ):
+        self.intervals                      = dict(intervals)
+        self.backoff_base                   = backoff_base
+        self.backoff_max                    = backoff_max
+        self.jitter                         = jitter
+        self.failures                       = 0
+        self.next_at: Dict[str, float]      = {family: 0.0 for family in intervals}
+
+
+    def due(self, now: float) -> FrozenSet[str]:
+        """Families due at the given (monotonic) time"""
+        return frozenset(family for family, at in self.next_at.items() if at <= now)
+
+
+    def next_due(self) -> float:
+        """Monotonic time at which the next family is due"""
+        return min(self.next_at.values())
+
+
+    def backoff_delay(self) -> float:
+        """Delay after the current run of failures: exponential, capped, with equal jitter"""
+        # Exponent capped: a device down for days would overflow the float conversion
+        doublings = min(max(0, self.failures - 1), 30)
+        ceiling = min(self.backoff_max, self.backoff_base * 2 ** doublings)
+        return random.uniform(ceiling / 2, ceiling)
+
+
+    def done(
+            self,
+            families: Iterable[str],
+            now: float,
+            answered: bool = True,
+            failed: AbstractSet[str] = frozenset()
+        ) -> None:
+        """
+        Reschedule after polling the families. A device that did not answer at all backs off.
+        Of an answer, the fetched families are due again after their interval, and the failed
+        ones (e.g. a rejected method) are retried with the next of them, or after the backoff
+        base at the latest
+        """
+        if not answered:
+            self.failures += 1
+            retry_at = now + self.backoff_delay()
+            # An unreachable device fails every family, so hold all of them back
+            for family in self.next_at:
+                self.next_at[family] = max(self.next_at[family], retry_at)
+            return
+        self.failures = 0
+        for family in families:
+            if family not in failed:
+                interval = self.intervals[family]
+                self.next_at[family] = now + interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if failed:
+            # Retried in the batch of the next family due, not in a round-trip of their own
+            pending = [at for family, at in self.next_at.items() if family not in failed]
+            retry_at = min(pending + [now + self.backoff_base * (1 + self.jitter)])
+            for family in failed:
+                self.next_at[family] = retry_at
+
+
+    def expedite(self, family: str, now: float) -> None:
+        """Make a family due now (e.g. to show the effect of a command); ignored while backing off"""
+        if self.failures == 0:
+            self.next_at[family] = min(self.next_at[family], now)
@@ -0,0 +1,93 @@
+"""# scrape_collector.py"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+from prometheus_client import CollectorRegistry
+from prometheus_client.registry import Collector
+
+log = logging.getLogger(__name__)
+
+
+class CoalescingTTLCache:
+    """
+    Runs a refresh coroutine on the device loop at most once per ttl seconds.
+    Callers from any thread that arrive while a refresh is running wait on that same
+    refresh instead of starting another one.
+    """
+
+    def __init__(
+            self,
+            loop: asyncio.AbstractEventLoop,
+            refresh: Callable[[], Awaitable[None]],
+            ttl: float
+        ):
+        self.loop                                               = loop
+        self.refresh                                            = refresh
+        self.ttl                                                = ttl
+        self._lock                                              = threading.Lock()
+        self._inflight: Optional[concurrent.futures.Future]     = None
+        self._refreshed_at: Optional[float]                     = None
+
+
+    def _is_fresh(self) -> bool:
+        """True while the last completed refresh is younger than the TTL"""
+        return self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.ttl
+
+
+    def _on_done(self, future: concurrent.futures.Future) -> None:
+        """Record a successful refresh and clear the in-flight slot"""
+        with self._lock:
+            # exception() raises on a cancelled future (e.g. the loop shutting down)
+            if not future.cancelled() and future.exception() is None:
+                self._refreshed_at = time.monotonic()
+            if self._inflight is future:
+                self._inflight = None
+
+
+    def ensure_fresh(self, timeout: float) -> bool:
+        """Refresh if the cache is stale; returns False if the data may be stale"""
+        with self._lock:
+            if self._is_fresh():
+                return True
+            future = self._inflight
+            if future is None:
+                future = asyncio.run_coroutine_threadsafe(self.refresh(), self.loop)
+                self._inflight = future
+                future.add_done_callback(self._on_done)
+        try:
+            future.result(timeout)
+            return True
+        except concurrent.futures.TimeoutError:
+            # The refresh keeps running; the next scrape picks up its result
+            log.warning("Device refresh did not finish within %.1fs, serving cached values", timeout)
+        except concurrent.futures.CancelledError:
+            log.warning("Device refresh was cancelled, serving cached values")
+        except Exception as e: # pylint: disable=broad-except
+            log.error("Device refresh failed: %s", e, exc_info=True)
+        return False
+
+
+class ScrapeCollector(Collector):
+    """
+    Exposes the device metrics of an inner registry, refreshing them from the devices
+    on scrape (behind the TTL cache) instead of from a fixed-interval poller
+    """
+
+    def __init__(self, device_registry: CollectorRegistry, cache: CoalescingTTLCache, timeout: float):
+        self.device_registry    = device_registry
+        self.cache              = cache
+        self.timeout            = timeout
+
+
+    def describe(self):
+        """Describe the device metrics without touching the devices"""
+        return self.device_registry.collect()
+
+
+    def collect(self):
+        """Refresh the device metrics if stale, then yield them"""
+        self.cache.ensure_fresh(self.timeout)
+        return self.device_registry.collect()
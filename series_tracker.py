@@ -0,0 +1,81 @@
+"""# series_tracker.py"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from prometheus_client.metrics import MetricWrapperBase
+
+log = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+
+class SeriesTracker:
+    """
+    Tracks which label sets each poll cycle refreshed, per owner (device), and removes
+    the series of label sets that were not refreshed for max_age cycles, e.g. after a
+    plug was renamed or unplugged, so they don't keep exporting their last value forever.
+    The metric children of a label set are resolved once and cached until it is removed,
+    so polls don't pay for .labels() lookups. With a state_factory, each label set also
+    keeps a state object (e.g. a sample window) for as long as its series exist.
+    """
+
+    def __init__(
+            self,
+            metrics: Iterable[MetricWrapperBase],
+            max_age: int,
+            state_factory: Optional[Callable[[], Any]] = None
+        ):
+        self.metrics                                            = list(metrics)
+        self.max_age                                            = max_age
+        self.state_factory                                      = state_factory
+        self._generation: Dict[str, int]                        = {}
+        # owner -> label set -> [last generation, children in metrics order, state]
+        self._seen: Dict[str, Dict[LabelValues, List[Any]]]     = {}
+
+
+    def start_cycle(self, owner: str) -> None:
+        """Begin a new poll cycle (generation) for the owner"""
+        self._generation[owner] = self._generation.get(owner, 0) + 1
+
+
+    def _entry(self, owner: str, labelvalues: LabelValues) -> List[Any]:
+        """Mark a label set as refreshed in the owner's current cycle and return its entry"""
+        seen = self._seen.get(owner)
+        if seen is None:
+            seen = self._seen[owner] = {}
+        entry = seen.get(labelvalues)
+        if entry is None:
+            children = [metric.labels(*labelvalues) for metric in self.metrics]
+            state = self.state_factory() if self.state_factory is not None else None
+            entry = seen[labelvalues] = [0, children, state]
+        entry[0] = self._generation.get(owner, 0)
+        return entry
+
+
+    def children(self, owner: str, labelvalues: LabelValues) -> List[Any]:
+        """
+        Mark a label set as refreshed in the owner's current cycle and return its metric
+        children, one per tracked metric in order
+        """
+        return self._entry(owner, labelvalues)[1]
+
+
+    def state(self, owner: str, labelvalues: LabelValues) -> Any:
+        """Mark a label set as refreshed and return its state (None without a state_factory)"""
+        return self._entry(owner, labelvalues)[2]
+
+
+    def sweep(self, owner: str) -> int:
+        """Remove the owner's series not refreshed within max_age cycles; returns how many"""
+        generation = self._generation.get(owner, 0)
+        seen = self._seen.get(owner, {})
+        stale = [labels for labels, entry in seen.items() if generation - entry[0] >= self.max_age]
+        for labels in stale:
+            del seen[labels]
+            for metric in self.metrics:
+                try:
+                    metric.remove(*labels)
+                except KeyError:
+                    pass
+        if stale:
+            log.info("Removed %d stale label set(s) of %s", len(stale), owner)
+        return len(stale)
@@ -0,0 +1,279 @@
+"""# sharding.py"""
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Callable, Dict, List, Optional, Set
+from prometheus_client import CollectorRegistry
+from prometheus_client.metrics_core import Metric
+from device_config import ShardSettings
+from exposition_cache import ExpositionCache
+
+log = logging.getLogger(__name__)
+
+# Self-metrics exist in every worker, so their samples get a shard label to stay unique
+SHARD_LABELLED_PREFIX = "tapo_p304m_exporter_"
+
+
+class ShardCollector:
+    """Merges the latest metric snapshot of every worker into one set of metric families"""
+
+    def __init__(self):
+        self._snapshots: Dict[int, List[Metric]]  = {}
+        self._ready: Set[int]                     = set()
+        self._lock                                = threading.Lock()
+
+
+    def update(self, shard: int, families: Optional[List[Metric]], ready: bool = False) -> None:
+        """Replace the snapshot and readiness of a worker; None forgets it (worker gone)"""
+        with self._lock:
+            if families is None:
+                self._snapshots.pop(shard, None)
+            else:
+                self._snapshots[shard] = families
+            if ready and families is not None:
+                self._ready.add(shard)
+            else:
+                self._ready.discard(shard)
+
+
+    def ready_count(self) -> int:
+        """Number of connected workers that reported ready"""
+        with self._lock:
+            return len(self._ready)
+
+
+    def collect(self):
+        with self._lock:
+            snapshots = sorted(self._snapshots.items())
+        merged: Dict[str, Metric] = {}
+        for shard, families in snapshots:
+            for family in families:
+                metric = merged.get(family.name)
+                if metric is None:
+                    metric = merged[family.name] = Metric(
+                        family.name, family.documentation, family.type, family.unit)
+                if family.name.startswith(SHARD_LABELLED_PREFIX):
+                    metric.samples.extend(
+                        sample._replace(labels={**sample.labels, 'shard': str(shard)})
+                        for sample in family.samples)
+                else:
+                    metric.samples.extend(family.samples)
+        return iter(merged.values())
+
+
+class ShardSupervisor:
+    """Starts the worker processes and restarts those that exit"""
+
+    def __init__(self, script: str, settings: ShardSettings, address: str, authkey: bytes):
+        self.script                                             = script
+        self.settings                                           = settings
+        self.address                                            = address
+        self.authkey                                            = authkey
+        self._workers: Dict[int, subprocess.Popen]              = {}
+        self._stopping                                          = False
+
+
+    def _start(self, index: int) -> None:
+        """Start the worker owning shard index"""
+        env = dict(
+            os.environ,
+            TAPO_SHARD_INDEX=str(index),
+            TAPO_SHARD_ADDRESS=self.address,
+            TAPO_SHARD_AUTHKEY=self.authkey.hex(),
+        )
+        self._workers[index] = subprocess.Popen([sys.executable, self.script], env=env)
+        log.info("Started shard %d/%d (pid %d)", index, self.settings.count, self._workers[index].pid)
+
+
+    def _monitor(self) -> None:
+        """Restart workers that exited"""
+        while not self._stopping:
+            time.sleep(1)
+            for index, worker in list(self._workers.items()):
+                if worker.poll() is not None and not self._stopping:
+                    log.warning("Shard %d exited with %s, restarting", index, worker.returncode)
+                    self._start(index)
+
+
+    def start(self) -> None:
+        """Start every worker and the monitor thread"""
+        for index in range(self.settings.count):
+            self._start(index)
+        threading.Thread(target=self._monitor, name="shard-supervisor", daemon=True).start()
+
+
+    def stop(self) -> None:
+        """Terminate every worker"""
+        self._stopping = True
+        for worker in self._workers.values():
+            worker.terminate()
+        for worker in self._workers.values():
+            worker.wait()
+
+
+class ShardFront:
+    """
+    Front process of the sharded mode: receives the snapshots the workers send over an
+    authenticated local connection and serves them, merged, from an ExpositionCache
+    """
+
+    def __init__(self, count: int):
+        self.count                  = count
+        self.authkey                = secrets.token_bytes(16)
+        self.listener               = Listener(("127.0.0.1", 0), authkey=self.authkey)
+        self.collector              = ShardCollector()
+        self.registry               = CollectorRegistry()
+        self.registry.register(self.collector)
+        self.exposition             = ExpositionCache(self.registry)
+
+
+    @property
+    def address(self) -> str:
+        """host:port workers connect to"""
+        host, port = self.listener.address
+        return f"{host}:{port}"
+
+
+    def ready(self) -> bool:
+        """Whether every worker is connected and ready"""
+        return self.collector.ready_count() == self.count
+
+
+    def _receive(self, conn: Connection) -> None:
+        """Store the snapshots of one worker until it disconnects"""
+        shard = None
+        try:
+            while True:
+                shard, families, ready = conn.recv()
+                self.collector.update(shard, families, ready)
+                self.exposition.invalidate()
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            if shard is not None:
+                log.warning("Shard %d disconnected", shard)
+                self.collector.update(shard, None)
+                self.exposition.invalidate()
+
+
+    def _accept(self) -> None:
+        """Accept worker connections"""
+        while True:
+            try:
+                conn = self.listener.accept()
+            except Exception as e: # pylint: disable=broad-except
+                # e.g. a client with the wrong authkey
+                log.warning("Rejected shard connection: %s", e)
+                continue
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+
+    def start(self) -> None:
+        """Accept workers and render their merged metrics in the background"""
+        threading.Thread(target=self._accept, name="shard-front", daemon=True).start()
+        self.exposition.start()
+
+
+class ShardSender:
+    """
+    Worker side: stands in for the ExpositionCache of the worker's registry, and sends a
+    snapshot of the registry to the front (debounced) after metrics were updated
+    """
+
+    def __init__(
+            self,
+            registry: CollectorRegistry,
+            settings: ShardSettings,
+            debounce: float = 1.0,
+            heartbeat: float = 15.0,
+            is_ready: Callable[[], bool] = lambda: True
+        ):
+        self.registry                           = registry
+        self.settings                           = settings
+        self.is_ready                           = is_ready
+        self.debounce                           = debounce
+        self.heartbeat                          = heartbeat
+        self._stale                             = threading.Event()
+        self._conn: Optional[Connection]        = None
+
+
+    def invalidate(self) -> None:
+        """Mark the registry changed (thread-safe; called from the poller loop)"""
+        self._stale.set()
+
+
+    def _connect(self) -> Connection:
+        """Connection to the front, opened on first use"""
+        if self._conn is None:
+            host, port = self.settings.address.rsplit(":", 1)
+            self._conn = Client((host, int(port)), authkey=bytes.fromhex(self.settings.authkey))
+        return self._conn
+
+
+    def _send(self) -> bool:
+        """Send one snapshot to the front, returns the readiness that was sent"""
+        self._stale.clear()
+        ready = self.is_ready()
+        try:
+            self._connect().send((self.settings.index, list(self.registry.collect()), ready))
+        except (OSError, EOFError) as e:
+            # The front is gone: nothing is served any more, so let the worker exit
+            log.error("Lost the front process: %s", e)
+            os._exit(1) # pylint: disable=protected-access
+        return ready
+
+
+    def _run(self) -> None:
+        """
+        Send a snapshot right away, then shortly after each change and at least every
+        heartbeat seconds; until ready, readiness is checked every debounce seconds so the
+        front learns of it at once (a shard that owns no devices may never invalidate)
+        """
+        ready = self._send()
+        while True:
+            if ready:
+                if self._stale.wait(self.heartbeat):
+                    time.sleep(self.debounce)
+            else:
+                deadline = time.monotonic() + self.heartbeat
+                while not self.is_ready() and time.monotonic() < deadline:
+                    if self._stale.wait(self.debounce):
+                        time.sleep(self.debounce)
+                        break
+            ready = self._send()
+
+
+    def start(self) -> None:
+        """Start the sender thread"""
+        threading.Thread(target=self._run, name="shard-sender", daemon=True).start()
+
+
+def run_front(app, settings: ShardSettings, script: str, host: str, port: int) -> None:
+    """
+    Start the workers and serve their merged metrics until the server stops; app is the
+    app factory's Flask app, ready once every worker is
+    """
+    # Imported here: only the front process serves HTTP
+    from waitress import serve
+    from exposition_cache import make_cached_wsgi_app
+
+    front = ShardFront(settings.count)
+    supervisor = ShardSupervisor(script, settings, front.address, front.authkey)
+    front.start()
+    supervisor.start()
+    app.extensions['tapo_metrics'] = make_cached_wsgi_app(front.exposition)
+    app.extensions['tapo_ready'] = front.ready
+    # SIGTERM (docker stop) unwinds through the finally below, so the workers are stopped too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    log.info("Starting Waitress HTTP server on %s:%d for %d shards", host, port, settings.count)
+    try:
+        serve(app, host=host, port=port)
+    finally:
+        supervisor.stop()
@@ -0,0 +1,148 @@
+"""# state_store.py"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, Optional, Set
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.metrics_core import Metric
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.registry import Collector, CollectorRegistry
+
+log = logging.getLogger(__name__)
+
+# File layout: magic, header length, JSON header (saved_at, devices), text exposition of the metrics
+STATE_MAGIC = b"TAPOSTATE1\n"
+_HEADER_LENGTH = struct.Struct(">I")
+# Self-metrics of the exporter, which are not saved
+EXPORTER_METRICS_PREFIX = "tapo_p304m_exporter_"
+
+
+class SavedState:
+    """Exporter state of the previous run: device metadata and the last device metrics"""
+
+    def __init__(self, saved_at: float, devices: Dict[str, Dict[str, Any]], metrics: str):
+        self.saved_at   = saved_at
+        self.devices    = devices  # address -> {'labels': {...}}
+        self.metrics    = metrics
+
+
+class DeviceMetrics(Collector):
+    """
+    The metric families of a registry that are saved with the state: all but the self-metrics.
+    Extra collectors (not registered on the registry) are saved after its own families.
+    """
+
+    def __init__(self, registry: CollectorRegistry, *extra: Collector):
+        self.collectors = (registry,) + extra
+
+
+    def collect(self):
+        for collector in self.collectors:
+            for family in collector.collect():
+                if not family.name.startswith(EXPORTER_METRICS_PREFIX):
+                    yield family
+
+
+def save_state(path: str, saved_at: float, devices: Dict[str, Dict[str, Any]], metrics: bytes) -> None:
+    """Write the state to a temporary file next to path and atomically replace path with it"""
+    header = json.dumps({"saved_at": saved_at, "devices": devices}, separators=(",", ":")).encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tapo-state-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(STATE_MAGIC + _HEADER_LENGTH.pack(len(header)) + header + metrics)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_state(path: str) -> Optional[SavedState]:
+    """Read the state file through a read-only memory map; None if missing or unreadable"""
+    try:
+        with open(path, "rb") as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(STATE_MAGIC)] != STATE_MAGIC:
+                raise ValueError("not a state file")
+            start = len(STATE_MAGIC) + _HEADER_LENGTH.size
+            (length,) = _HEADER_LENGTH.unpack_from(data, len(STATE_MAGIC))
+            header = json.loads(data[start:start + length])
+            metrics = data[start + length:].decode("utf-8")
+        return SavedState(header["saved_at"], header["devices"], metrics)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        log.warning("Ignoring unreadable state file %s: %s", path, e)
+        return None
+
+
+class RestoredCollector:
+    """
+    Serves the metrics of the previous run for the devices that have not been polled yet,
+    marked by tapo_p304m_exporter_restored_timestamp_seconds (time they were saved).
+    A device's restored series are dropped as soon as it is polled again; until then, those
+    of each metric the device already has live series of, so no series is exported twice.
+    """
+
+    def __init__(self, state: SavedState):
+        self.saved_at                               = state.saved_at
+        self._families                              = list(text_string_to_metric_families(state.metrics))
+        # device_id label of each address still served from the saved state
+        self._pending: Dict[str, str]               = {
+            address: device['labels']['device_id'] for address, device in state.devices.items()
+        }
+        # Metric names each pending address already has live series of
+        self._live: Dict[str, Set[str]]             = {}
+        self._lock                                  = threading.Lock()
+
+
+    def device_refreshed(self, address: str) -> None:
+        """Stop serving the restored series of a device (it has fresh data now)"""
+        with self._lock:
+            self._pending.pop(address, None)
+            self._live.pop(address, None)
+
+
+    def metrics_refreshed(self, address: str, names: Iterable[str]) -> None:
+        """Stop serving the restored series of some metrics of a device (it has live ones now)"""
+        with self._lock:
+            if address in self._pending:
+                self._live.setdefault(address, set()).update(names)
+
+
+    def is_pending(self, address: str) -> bool:
+        """Whether the device's restored series are still served"""
+        with self._lock:
+            return address in self._pending
+
+
+    def collect(self):
+        with self._lock:
+            pending = dict(self._pending)
+            # device_id -> metric names no longer restored
+            live = {pending[address]: frozenset(names) for address, names in self._live.items()}
+        if not pending:
+            return
+        device_ids: Set[str] = set(pending.values())
+        for family in self._families:
+            samples = [
+                s for s in family.samples
+                if s.labels.get('device_id') in device_ids
+                and family.name not in live.get(s.labels['device_id'], ())
+            ]
+            if samples:
+                metric = Metric(family.name, family.documentation, family.type, family.unit)
+                metric.samples = samples
+                yield metric
+        restored = GaugeMetricFamily(
+            'tapo_p304m_exporter_restored_timestamp_seconds',
+            'Device series served from the saved state of the previous run, by save time (unix time)',
+            labels=['address'])
+        for address in pending:
+            restored.add_metric([address], self.saved_at)
+        yield restored
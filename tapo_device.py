@@ -1,14 +1,104 @@
 """# tapo_device.py"""
 import logging
 from base64 import b64decode
-from typing import Optional, Dict, Any, Type
-from auth_protocol import AuthProtocol
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple, Type
+from auth_protocol import AuthProtocol, AsyncAuthProtocol, AuthProtocolError
+from metadata_cache import MetadataCache
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 log = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=1024)
+def decode_text(encoded: str) -> Optional[str]:
+    """Decode a base64 text field; nicknames rarely change, so decodes are cached"""
+    try:
+        return b64decode(encoded).decode('utf-8')
+    except Exception: # pylint: disable=broad-except
+        return None
+
+
+def decode_child_nicknames(result: dict) -> dict:
+    """Decode the base64 nicknames of a get_child_device_list result in place"""
+    for device in result.get('child_device_list', []):
+        # Decode nickname
+        if device.get('nickname'):
+            nickname = decode_text(device['nickname'])
+            if nickname is not None:
+                device['nickname'] = nickname
+    return result
+
+
+def decode_info_field(data: dict, field: str) -> str:
+    """Decode a base64 field (nickname, description) of a get_device_info result"""
+    decoded = decode_text(data.get(field, ""))
+    if decoded is None:
+        log.error("Failed to decode device %s", field)
+        return ""
+    return decoded
+
+
+# Requests the device accepts in one multipleRequest envelope
+MULTIPLE_REQUEST_BATCH_SIZE = 5
+
+# Error code of firmware that does not know a method (here: multipleRequest)
+UNKNOWN_METHOD_ERROR = -40210
+
+# Static methods whose results are kept in the device's MetadataCache
+METADATA_METHODS = frozenset({"get_device_info", "get_child_device_component_list"})
+DEFAULT_METADATA_TTL = 300
+# Keys whose change is reported; get_device_info also carries volatile fields (on_time, rssi, ...)
+METADATA_CHANGE_KEYS = {
+    "get_device_info": ("device_id", "hw_id", "fw_ver", "ip", "type", "model", "nickname"),
+}
+
+# Post-processing applied to a method result, whether fetched alone or in a batch
+RESULT_DECODERS = {
+    "get_child_device_list": decode_child_nicknames,
+}
+
+
+def child_request(device_id: str, method: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """control_child params wrapping one request for a child device (plug)"""
+    return {"device_id": device_id, "requestData": {"method": method, "params": params or {}}}
+
+
+def child_response(result: Dict[str, Any]) -> Any:
+    """Result of a control_child request; raises on the child's error code"""
+    response = result.get("responseData") or {}
+    error_code = response.get("error_code", 0)
+    if error_code != 0:
+        raise AuthProtocolError(f"Child request failed with error code {error_code}", error_code)
+    return response.get("result") or {}
+
+
+def multiple_request_batches(
+        requests: Dict[str, Optional[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+    """Split method requests into multipleRequest params of at most MULTIPLE_REQUEST_BATCH_SIZE"""
+    items = [{"method": method, "params": params or {}} for method, params in requests.items()]
+    return [
+        {"requests": items[i:i + MULTIPLE_REQUEST_BATCH_SIZE]}
+        for i in range(0, len(items), MULTIPLE_REQUEST_BATCH_SIZE)
+    ]
+
+
+def parse_multiple_response(result: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """Split a multipleRequest result into per-method results and per-method error codes"""
+    results: Dict[str, Any] = {}
+    errors: Dict[str, int] = {}
+    for response in result.get("responses", []):
+        method = response.get("method")
+        error_code = response.get("error_code", 0)
+        if error_code != 0:
+            errors[method] = error_code
+            continue
+        decoder = RESULT_DECODERS.get(method)
+        value = response.get("result") or {}
+        results[method] = decoder(value) if decoder else value
+    return results, errors
+
+
 class TapoDevice:
     """
     Base class for Tapo devices, providing common functionality
@@ -27,6 +117,7 @@ class TapoDevice:
             email: str,
             password: str,
             preferred_protocol: Optional[str] = None,
+            metadata_ttl: float = DEFAULT_METADATA_TTL,
             **kwargs
         ):
         self.address                            = address
@@ -35,6 +126,15 @@ class TapoDevice:
         self.kwargs                             = kwargs
         self.protocol: Optional[AuthProtocol]   = None
         self.preferred_protocol                 = preferred_protocol
+        self.multiple_request_supported         = True
+        self.metadata                           = MetadataCache(metadata_ttl, METADATA_CHANGE_KEYS)
+
+
+    def _remember(self, results: Dict[str, Any]) -> None:
+        """Store fetched static results in the metadata cache and log when they changed"""
+        for method in METADATA_METHODS.intersection(results):
+            if self.metadata.put(method, results[method]):
+                log.info("%s of %s changed", method, self.address)
 
 
     def _initialize(self):
@@ -66,6 +166,47 @@ class TapoDevice:
         return self.protocol.request(method, params or {})
 
 
+    def request_multiple(self, requests: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Send several methods in multipleRequest envelopes and return the results per method.
+        Methods the device answers with an error are left out of the result (and logged);
+        firmware without multipleRequest support falls back to one request per method.
+        """
+        if not self.multiple_request_supported:
+            return self._request_each(requests)
+        results: Dict[str, Any] = {}
+        for batch in multiple_request_batches(requests):
+            try:
+                response = self.request("multipleRequest", batch)
+            except AuthProtocolError as e:
+                if e.error_code != UNKNOWN_METHOD_ERROR:
+                    raise
+                log.warning("multipleRequest rejected by %s, using single requests", self.address)
+                self.multiple_request_supported = False
+                return self._request_each(requests)
+            batch_results, errors = parse_multiple_response(response)
+            if errors:
+                log.warning("Batched request errors from %s: %s", self.address, errors)
+            results.update(batch_results)
+        self._remember(results)
+        return results
+
+
+    def _request_each(self, requests: Dict[str, Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Fallback for request_multiple: one request per method"""
+        results: Dict[str, Any] = {}
+        for method, params in requests.items():
+            try:
+                value = self.request(method, params)
+            except AuthProtocolError as e:
+                log.warning("Request %s to %s failed: %s", method, self.address, e)
+                continue
+            decoder = RESULT_DECODERS.get(method)
+            results[method] = decoder(value) if decoder else value
+        self._remember(results)
+        return results
+
+
     def handshake(self) -> None:
         """Perform handshake to establish communication."""
         self._ensure_protocol()
@@ -76,14 +217,28 @@ class TapoDevice:
         self.handshake()
 
 
-    def get_device_info(self) -> dict:
-        """Get device information"""
-        return self.request("get_device_info")
+    def _cached_request(self, method: str, refresh: bool) -> dict:
+        """Static method result from the metadata cache, fetched when stale or on refresh"""
+        cached = None if refresh else self.metadata.get(method)
+        if cached is not None:
+            return cached
+        value = self.request(method)
+        self._remember({method: value})
+        return value
+
+    def get_device_info(self, refresh: bool = False) -> dict:
+        """Get device information (cached for the metadata TTL)"""
+        return self._cached_request("get_device_info", refresh)
 
     def set_device_info(self, params: Dict[str, Any]) -> dict:
         """Internal method to set device information"""
+        self.metadata.invalidate("get_device_info")
         return self.request("set_device_info", params)
 
+    def control_child(self, device_id: str, method: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Send a request to a child device (plug), e.g. set_device_info"""
+        return child_response(self.request("control_child", child_request(device_id, method, params)))
+
     # Some endpoints taken from:
     # - https://pypi.org/project/tapo-plug/
     # - https://github.com/softScheck/tplink-smartplug/blob/master/tplink-smarthome-commands.txt
@@ -92,21 +247,12 @@ class TapoDevice:
     # new added
     def get_child_device_list(self) -> dict:
         """Get the list of child devices (plugs) connected to the main device"""
-        result = self.request("get_child_device_list")
-        child_list = result.get('child_device_list', [])
-        for device in child_list:
-            # Decode nickname
-            if device.get('nickname'):
-                try:
-                    device['nickname'] = b64decode(device['nickname']).decode('utf-8')
-                except Exception:
-                    pass
-        return result
+        return decode_child_nicknames(self.request("get_child_device_list"))
 
     # new added
-    def get_child_device_component_list(self) -> dict:
-        """Get the list of components for each child device"""
-        return self.request("get_child_device_component_list")
+    def get_child_device_component_list(self, refresh: bool = False) -> dict:
+        """Get the list of components for each child device (cached for the metadata TTL)"""
+        return self._cached_request("get_child_device_component_list", refresh)
 
     # new added
     def get_latest_fw(self) -> dict:
@@ -130,22 +276,173 @@ class TapoDevice:
 
     def get_device_name(self) -> str:
         """Get the device name (decoded from base64)."""
-        data = self.get_device_info()
-        try:
-            encoded_name = data.get("nickname", "")
-            name = b64decode(encoded_name).decode("utf-8")
-        except Exception: # pylint: disable=broad-except
-            log.exception("Failed to decode device nickname")
-            name = ""
-        return name
-    
+        return decode_info_field(self.get_device_info(), "nickname")
+
     def get_device_description(self) -> str:
         """Get the device description (decoded from base64)."""
-        data = self.get_device_info()
+        return decode_info_field(self.get_device_info(), "description")
+
+
+class AsyncTapoDevice(TapoDevice):
+    """
+    Tapo device over the asyncio transport; same API as TapoDevice, with coroutine methods
+    so pollers never block the event loop
+    """
+
+    protocol_classes: Dict[str, Type[AsyncAuthProtocol]] = { # type: ignore[assignment]
+        "new": AsyncAuthProtocol
+    }
+
+    protocol: Optional[AsyncAuthProtocol] # type: ignore[assignment]
+
+
+    async def _initialize(self):
+        """Initialize the device protocol based on the preferred protocol or available protocols"""
+        preferred = self.preferred_protocol or "new"
+        protocol_cls = self.protocol_classes.get(preferred)
+        if not protocol_cls:
+            raise ValueError(f"Unsupported protocol: {preferred}")
+
         try:
-            encoded_description = data.get("description", "")
-            description = b64decode(encoded_description).decode("utf-8")
-        except Exception: # pylint: disable=broad-except
-            log.exception("Failed to decode device description")
-            description = ""
-        return description
+            self.protocol = protocol_cls(self.address, self.email, self.password, **self.kwargs)
+            await self.protocol.initialize()
+        except Exception as e:
+            log.exception("Failed to initialize protocol %s", protocol_cls.__name__)
+            raise RuntimeError("Failed to initialize protocol") from e
+
+
+    async def _ensure_protocol(self) -> None:
+        """Ensure protocol is initialized"""
+        if not self.protocol:
+            await self._initialize()
+
+
+    async def request(self, method: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        """Make a request to the device using the specified method and parameters."""
+        await self._ensure_protocol()
+        if self.protocol is None:
+            raise RuntimeError("Protocol is not initialized")
+        return await self.protocol.request(method, params or {})
+
+
+    async def request_multiple(
+            self,
+            requests: Dict[str, Optional[Dict[str, Any]]]
+        ) -> Dict[str, Any]:
+        """
+        Send several methods in multipleRequest envelopes and return the results per method.
+        Methods the device answers with an error are left out of the result (and logged);
+        firmware without multipleRequest support falls back to one request per method.
+        """
+        if not self.multiple_request_supported:
+            return await self._request_each(requests)
+        results: Dict[str, Any] = {}
+        for batch in multiple_request_batches(requests):
+            try:
+                response = await self.request("multipleRequest", batch)
+            except AuthProtocolError as e:
+                if e.error_code != UNKNOWN_METHOD_ERROR:
+                    raise
+                log.warning("multipleRequest rejected by %s, using single requests", self.address)
+                self.multiple_request_supported = False
+                return await self._request_each(requests)
+            batch_results, errors = parse_multiple_response(response)
+            if errors:
+                log.warning("Batched request errors from %s: %s", self.address, errors)
+            results.update(batch_results)
+        self._remember(results)
+        return results
+
+
+    async def _request_each(
+            self,
+            requests: Dict[str, Optional[Dict[str, Any]]]
+        ) -> Dict[str, Any]:
+        """Fallback for request_multiple: one request per method"""
+        results: Dict[str, Any] = {}
+        for method, params in requests.items():
+            try:
+                value = await self.request(method, params)
+            except AuthProtocolError as e:
+                log.warning("Request %s to %s failed: %s", method, self.address, e)
+                continue
+            decoder = RESULT_DECODERS.get(method)
+            results[method] = decoder(value) if decoder else value
+        self._remember(results)
+        return results
+
+
+    async def handshake(self) -> None:
+        """Perform handshake to establish communication."""
+        await self._ensure_protocol()
+
+
+    async def login(self) -> None:
+        """Login to the device."""
+        await self.handshake()
+
+
+    async def close(self) -> None:
+        """Close the underlying connection"""
+        if self.protocol is not None:
+            await self.protocol.close()
+
+
+    async def _cached_request(self, method: str, refresh: bool) -> dict:
+        """Static method result from the metadata cache, fetched when stale or on refresh"""
+        cached = None if refresh else self.metadata.get(method)
+        if cached is not None:
+            return cached
+        value = await self.request(method)
+        self._remember({method: value})
+        return value
+
+    async def get_device_info(self, refresh: bool = False) -> dict:
+        """Get device information (cached for the metadata TTL)"""
+        return await self._cached_request("get_device_info", refresh)
+
+    async def set_device_info(self, params: Dict[str, Any]) -> dict:
+        """Internal method to set device information"""
+        self.metadata.invalidate("get_device_info")
+        return await self.request("set_device_info", params)
+
+    async def control_child(
+            self,
+            device_id: str,
+            method: str,
+            params: Optional[Dict[str, Any]] = None
+        ) -> Any:
+        """Send a request to a child device (plug), e.g. set_device_info"""
+        return child_response(await self.request("control_child", child_request(device_id, method, params)))
+
+    async def get_child_device_list(self) -> dict:
+        """Get the list of child devices (plugs) connected to the main device"""
+        return decode_child_nicknames(await self.request("get_child_device_list"))
+
+    async def get_child_device_component_list(self, refresh: bool = False) -> dict:
+        """Get the list of components for each child device (cached for the metadata TTL)"""
+        return await self._cached_request("get_child_device_component_list", refresh)
+
+    async def get_latest_fw(self) -> dict:
+        """Get the latest firmware information for the device"""
+        return await self.request("get_latest_fw")
+
+    async def get_fw_download_state(self) -> dict:
+        """Get the current state of the firmware download"""
+        return await self.request("get_fw_download_state")
+
+    async def get_device_usage(self) -> dict:
+        """Get the device usage statistics"""
+        return await self.request("get_device_usage")
+
+    async def get_realtime_power_usage(self) -> dict:
+        """Get the real-time power usage of the device"""
+        return await self.request("get_realtime")
+
+    async def get_device_name(self) -> str:
+        """Get the device name (decoded from base64)."""
+        return decode_info_field(await self.get_device_info(), "nickname")
+
+    async def get_device_description(self) -> str:
+        """Get the device description (decoded from base64)."""
+        return decode_info_field(await self.get_device_info(), "description")
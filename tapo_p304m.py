@@ -3,8 +3,6 @@ import logging
 from typing import Dict, Any, List
 from tapo_device import TapoDevice
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def nan_usage():
@@ -28,6 +26,69 @@ def empty_device_info():
     }
 
 
+# Columns of a PlugTable: identity, state (from get_child_device_list), realtime (get_realtime)
+PLUG_IDENTITY_FIELDS = ('position', 'device_id', 'nickname')
+PLUG_STATE_FIELDS = ('device_on', 'on_time', 'overcurrent_status', 'overheat_status', 'charging_status')
+PLUG_REALTIME_FIELDS = ('current_ma', 'voltage_mv', 'power_mw', 'total_wh')
+
+
+class PlugTable:
+    """Merged plug data of one poll, column-wise: one list per field, one row per plug"""
+
+    __slots__ = PLUG_IDENTITY_FIELDS + PLUG_STATE_FIELDS + PLUG_REALTIME_FIELDS
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, [])
+
+
+    def __len__(self) -> int:
+        return len(self.position)
+
+
+    def append(self, plug: Dict[str, Any], realtime: Dict[str, Any]) -> None:
+        """Add the row of one plug"""
+        self.position.append(plug.get('position'))
+        self.device_id.append(plug.get('device_id'))
+        self.nickname.append(plug.get('nickname'))
+        self.device_on.append('ON' if plug.get('device_on') else 'OFF')
+        self.on_time.append(plug.get('on_time'))
+        self.overcurrent_status.append(plug.get('overcurrent_status'))
+        self.overheat_status.append(plug.get('overheat_status'))
+        self.charging_status.append(plug.get('charging_status', 'unknown'))
+        for field in PLUG_REALTIME_FIELDS:
+            getattr(self, field).append(realtime.get(field))
+
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """The plugs as one dict per plug"""
+        return [{field: getattr(self, field)[i] for field in self.__slots__} for i in range(len(self))]
+
+
+def _match_realtime(plugs: List[Dict[str, Any]], data: List[Dict[str, Any]]) -> List[Any]:
+    """Realtime entry of each plug, or None: by device_id or position when the firmware reports them"""
+    for key in ('device_id', 'position'):
+        if data and all(key in entry for entry in data):
+            by_key = {entry[key]: entry for entry in data}
+            return [by_key.get(plug.get(key)) for plug in plugs]
+    # Otherwise the device lists realtime data in reverse plug order
+    return [data[-(i + 1)] if i < len(data) else None for i in range(len(plugs))]
+
+
+def join_plugs(plugs_info: Dict[str, Any], plugs_usage: Dict[str, Any]) -> PlugTable:
+    """Join get_child_device_list and get_realtime results; plugs without realtime data are left out"""
+    plugs = plugs_info.get('child_device_list', [])
+    table = PlugTable()
+    for plug, realtime in zip(plugs, _match_realtime(plugs, plugs_usage.get('data', []))):
+        if realtime is not None:
+            table.append(plug, realtime)
+    return table
+
+
+# Methods of the plug table: plug states plus their realtime data
+PLUG_METHODS = {"get_child_device_list": None, "get_realtime": None}
+
+
 class TapoP304m:
     """
     Tapo P304m device class for managing Tapo P304m smart plugs
@@ -62,28 +123,13 @@ class TapoP304m:
             return nan_usage()
 
 
-    def tapo_p304m_plugs(self) -> Dict[str, List[Dict[str, Any]]]:
+    def tapo_p304m_plugs(self) -> PlugTable:
         """Get the list of plugs connected to the Tapo P304m device"""
         try:
-            plugs_info = self.tapo_device.get_child_device_list()
-            plugs_usage = self.tapo_device.get_realtime_power_usage()
-
-            plugs = plugs_info.get('child_device_list', [])
-            usage_data = plugs_usage.get('data', [])
-            n = min(len(plugs), len(usage_data))
-
-            for i in range(n):
-                # Map usage data in reverse order (as in your logic)
-                plugs[i].update(usage_data[-(i+1)])
-
-                # Standardize status fields
-                plugs[i]['device_on'] = 'ON' if plugs[i].get('device_on') else 'OFF'
-                plugs[i]['charging_status'] = plugs[i].get('charging_status', 'unknown')
-
-            # Return only actual plugs detected and merged
-            return {'child_device_list': plugs[:n]}
+            results = self.tapo_device.request_multiple(PLUG_METHODS)
+            return join_plugs(results["get_child_device_list"], results["get_realtime"])
 
         except Exception as ex: # pylint: disable=broad-except
             logger.warning("Failed to get plug info from %s: %s", self.ip_address, ex)
-            # On error, return *empty* list (no phantom plugs)
-            return {'child_device_list': []}
+            # On error, return an *empty* table (no phantom plugs)
+            return PlugTable()